@@ -0,0 +1,258 @@
+"""Scan throughput benchmark against the simulated instruments (hardware/simulation.py).
+
+Runs Experiment with 1D/2D/3D Scanner plans of different sizes and record lengths and stores, for every case,
+the points per second, the time spent in every phase (plan compile, move, settle, acquisition, transfer, decode,
+write), the peak RSS and the size of OscData.hdf5 in a JSON file, so runs of different versions of the code can
+be compared. Every case runs in its own process so that its peak RSS is its own.
+
+    python benchmarks/scan_benchmark.py                 full suite, record lengths from 10k to 10M points
+    python benchmarks/scan_benchmark.py --quick         a few small cases
+    python benchmarks/scan_benchmark.py --config        only the scan of config.py, on simulated instruments
+
+The phases are summed action durations: move is MoveStage/MoveStages/MoveToCoords/SetVelocity/FlyStage, settle
+Wait/WAIT_ACQ/WAIT_READY, acquisition the other scope actions, transfer the time the simulated scope spends sending
+CURVE? data, decode the rest of GET_DATA/GET_FRAMES (without the time the simulation needs to make up the traces,
+reported as transfers/generateSeconds) and write the time of ExperimentOutput._writeStepData (on the
+background writer thread if it is enabled). Actions that run at the same time (pipelined scans) are all counted.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import shutil
+from ctypes import c_char_p
+
+repoDirectory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0,repoDirectory)
+
+import numpy as np
+import h5py
+import config
+from experiment import Experiment,ExperimentOutput
+from hardware.instrumentComponent import instrumentHandler
+from hardware import simulation
+from utils.modules import Scanner
+from utils.progress import phaseOf
+
+phases = ['compile','move','settle','acquisition','transfer','decode','write']
+
+#scans around the center of the simulated beam, [moduleType,axes,startCoords,stopCoords,step_size]
+scans = {'1D':['1DScan',['X'],[8.5,13.5,0],[9.5,13.5,0],[0.1,1,1]],
+         '2D':['2DScan',['X','Y'],[8.5,13,0],[9.5,14,0],[0.25,0.25,1]],
+         '3D':['3DScan',['X','Y','Z'],[8.5,13,-1],[9.5,14,1],[0.5,0.5,1]]}
+fullSuite = [('1D',10**4),('1D',10**5),('1D',10**6),('1D',10**7),('2D',10**4),('2D',10**5),('2D',10**6),('3D',10**4),('3D',10**5)]
+quickSuite = [('1D',10**4),('1D',10**5),('2D',10**4)]
+
+
+class PhaseTimings():
+    def __init__(self):
+        self.seconds = {phase:0.0 for phase in phases}
+        self._lock = threading.Lock()
+
+    def add(self,phase,seconds):
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase,0.0)+seconds
+
+
+class TimedInstrumentHandler(instrumentHandler):
+    def __init__(self,simulationSettings,timings):
+        super().__init__(simulationSettings)
+        self._timings = timings
+
+    def runAction(self,action):
+        start = time.perf_counter()
+        try:
+            return super().runAction(action)
+        finally:
+            self._timings.add(phaseOf.get(action._actionType,'acquisition'),time.perf_counter()-start)
+
+
+class TimedOutput(ExperimentOutput):
+    def __init__(self,experimentName,outputRoot,settings,timings):
+        super().__init__(experimentName,outputRoot,settings)
+        self._timings = timings
+
+    def dataFile(self):
+        return self._fileNameh
+
+    def _writeStepData(self,timeStamp,action,output):
+        start = time.perf_counter()
+        try:
+            return super()._writeStepData(timeStamp,action,output)
+        finally:
+            self._timings.add('write',time.perf_counter()-start)
+
+
+def peakRSS():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak*1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError,AttributeError):
+        return None
+
+
+def commitOf(directory):
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],cwd=directory,capture_output=True,text=True,check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git','status','--porcelain','--untracked-files=no'],cwd=directory,capture_output=True,text=True,check=True).stdout.strip())
+        return commit,dirty
+    except (OSError,subprocess.CalledProcessError):
+        return None,None
+
+
+def benchmarkInstruments():
+    stageData = [[f'{axis}-Stage','linear',c_char_p(str(number).encode()),axis] for number,axis in enumerate(['X','Y','Z'])]
+    return [['Tektronix_DPO4102B','ScanOsc',{'ipAddress':'simulated'}],
+            ['KinesisController','ScanStage',{'createStages':True,'stageData':stageData,'homeStages':False}]]
+
+
+def makeScanner(case,args):
+    if case['scan'] == 'config':
+        return config.scanner
+    moduleType,axes,startCoords,stopCoords,steps = scans[case['scan']]
+    return Scanner(moduleType,axes,startCoords,stopCoords,steps,'ScanStage','ScanOsc',args['settle'],1000,channels=args['channels'],waitMode=args['waitMode'],pipelined=args['pipelined'])
+
+
+def runCase(case,args):
+    timings = PhaseTimings()
+    settings = dict(args['simulationSettings'])
+    if case['recordLength'] is not None:
+        settings['recordLength'] = case['recordLength']
+    startRSS = peakRSS()
+    log = None if args['verbose'] else open(os.devnull,'w')
+    with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+        instHandler = TimedInstrumentHandler(settings,timings)
+        for inst in (config.instruments if case['scan'] == 'config' else benchmarkInstruments()):
+            instHandler.add_instrument(inst)
+        bench = simulation.get_bench()
+        output = TimedOutput(case['name'],args['outputRoot'],args['outputSettings'],timings)
+        experiment = Experiment(case['name'],instHandler=instHandler,scanner=makeScanner(case,args),output=output)
+        start = time.perf_counter()
+        experiment.loadScanner()
+        #the plan is generated lazily, counting its records walks all of it once
+        records = experiment.countSteps()
+        timings.add('compile',time.perf_counter()-start)
+        start = time.perf_counter()
+        experiment.runExperiment()
+        runTime = time.perf_counter()-start
+    if log:
+        log.close()
+    transfers = dict(bench.transfers)
+    #the transfer of the curve data is part of GET_DATA/GET_FRAMES, the rest of them is decoding apart from the time
+    #the simulated scope needs to make up the traces, which a real scope has ready
+    timings.seconds['decode'] = max(0.0,timings.seconds['transfer']-transfers['seconds']-transfers['generateSeconds'])
+    timings.seconds['transfer'] = transfers['seconds']
+    dataFile = output.dataFile()
+    points = int(np.prod([len(coords) for coords in experiment.scanner.coordinates().values()]))
+    return {'name':case['name'],
+            'scan':case['scan'],
+            'moduleType':config.moduleType if case['scan'] == 'config' else scans[case['scan']][0],
+            'recordLength':settings.get('recordLength',simulation.SimulatedBench.defaults['recordLength']),
+            'points':points,
+            'records':records,
+            'runTime':runTime,
+            'pointsPerSecond':points/runTime if runTime else None,
+            'phases':timings.seconds,
+            'transfers':transfers,
+            'startRSS':startRSS,
+            'peakRSS':peakRSS(),
+            'fileSize':os.path.getsize(dataFile) if os.path.exists(dataFile) else None}
+
+
+def runIsolated(case,args):
+    #a fresh process per case, so that peakRSS is the peak of this case only
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(runCase,(case,args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan throughput benchmark against simulated instruments.')
+    parser.add_argument('--quick',action='store_true',help='run a few small cases only')
+    parser.add_argument('--config',action='store_true',help='benchmark the scan of config.py instead of the suite')
+    parser.add_argument('--record-lengths',type=int,nargs='+',help='record lengths of the suite, default 10k to 10M points')
+    parser.add_argument('--scans',nargs='+',choices=sorted(scans),help='scan sizes of the suite')
+    parser.add_argument('--settle',type=float,default=0.01,help='stageSettleTime of the scans in s')
+    parser.add_argument('--wait-mode',choices=['fixed','event'],default='event',help="waitMode of the scans, 'fixed' sleeps 0.5 s before every read")
+    parser.add_argument('--channels',type=int,nargs='+',default=[2],help='scope channels read at every point')
+    parser.add_argument('--pipelined',action='store_true',help='run the plans pipelined on the scheduler')
+    parser.add_argument('--latency',type=float,help='simulated command latency in s')
+    parser.add_argument('--bandwidth',type=float,help='simulated scope transfer bandwidth in bytes/s')
+    parser.add_argument('--stage-velocity',type=float,default=20.0,help='simulated stage velocity in mm/s')
+    parser.add_argument('--storage-mode',choices=['volts','raw'],default='volts')
+    parser.add_argument('--step-file-format',choices=['txt','npy','bin','none'],default='none')
+    parser.add_argument('--no-background-writer',action='store_true')
+    parser.add_argument('--output',help='JSON file for the results, default benchmarks/results/scan-<time>.json')
+    parser.add_argument('--keep',help='keep the experiment folders in this directory instead of a temporary one')
+    parser.add_argument('--verbose',action='store_true',help='show the output of the experiments')
+    args = parser.parse_args()
+
+    simulationSettings = dict(config.simulationSettings)
+    simulationSettings['stageVelocity'] = args.stage_velocity
+    if args.latency is not None:
+        simulationSettings['latency'] = args.latency
+    if args.bandwidth is not None:
+        simulationSettings['bandwidth'] = args.bandwidth
+    if args.config:
+        cases = [{'name':'config','scan':'config','recordLength':None}]
+    else:
+        suite = quickSuite if args.quick else fullSuite
+        if args.scans or args.record_lengths:
+            suite = [(scan,recordLength) for scan in (args.scans or sorted(scans)) for recordLength in (args.record_lengths or [10**4,10**5,10**6,10**7])]
+        cases = [{'name':f'{scan}-{recordLength}','scan':scan,'recordLength':recordLength} for scan,recordLength in suite]
+
+    outputRoot = args.keep or tempfile.mkdtemp(prefix='scan_benchmark')
+    os.makedirs(outputRoot,exist_ok=True)
+    caseArgs = {'simulationSettings':simulationSettings,
+                'outputSettings':{'flushInterval':100,'backgroundWriter':not args.no_background_writer,'writeQueueSize':16,'stepFileFormat':args.step_file_format,'storageMode':args.storage_mode},
+                'outputRoot':outputRoot,
+                'settle':args.settle,
+                'channels':args.channels,
+                'waitMode':args.wait_mode,
+                'pipelined':args.pipelined,
+                'verbose':args.verbose}
+    commit,dirty = commitOf(repoDirectory)
+    results = {'time':datetime.datetime.now().isoformat(timespec='seconds'),
+               'commit':commit,
+               'dirty':dirty,
+               'python':platform.python_version(),
+               'platform':platform.platform(),
+               'numpy':np.__version__,
+               'h5py':h5py.__version__,
+               'settings':{key:value for key,value in caseArgs.items() if key not in ['outputRoot','verbose']},
+               'cases':[]}
+    try:
+        for case in cases:
+            result = runIsolated(case,caseArgs)
+            results['cases'].append(result)
+            print(f"{result['name']:>12}: {result['points']} points in {result['runTime']:.2f} s, {result['pointsPerSecond']:.2f} points/s, "
+                  f"peak RSS {result['peakRSS']/2**20 if result['peakRSS'] else float('nan'):.0f} MB, file {(result['fileSize'] or 0)/2**20:.1f} MB")
+            print('              '+', '.join(f'{phase} {result["phases"].get(phase,0.0):.2f} s' for phase in phases))
+    finally:
+        if not args.keep:
+            shutil.rmtree(outputRoot,ignore_errors=True)
+    fileName = args.output
+    if fileName is None:
+        fileName = os.path.join(repoDirectory,'benchmarks','results','scan-'+datetime.datetime.now().strftime('%Y%m%d-%H%M%S')+'.json')
+    os.makedirs(os.path.dirname(os.path.abspath(fileName)),exist_ok=True)
+    with open(fileName,'w') as file:
+        json.dump(results,file,indent=2)
+    print(f'Results written to {fileName}')
+
+
+if __name__=="__main__":
+    main()
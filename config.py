@@ -36,27 +36,64 @@ instruments.append(data)
 
 ######################### Scan Config #######################################################
 #here you can set things about the scan
-moduleType = '2DScan'     #this decided the type of the scan it can be 1DScan,2DScan,3DScan
+moduleType = '2DScan'     #this decided the type of the scan it can be 1DScan,2DScan,3DScan, FlyScan (steps all axes but the last one and flies over the last one) AdaptiveScan (2D, refines around the beam) or NDScan (every stage of scanAxes)
 axes = ['X','Y']           #you can add axes here the first axes will be the major axis and others will be considered minor in that order  
 startCoords = [8,13,0]    # 3D coordinates  always   
 stopCoords = [10,14,0]     #  3D coordinates  always 
 step_size =  [1,1,1]  #step sizes for each axis
+scanAxes = None            #named stages to scan instead of axes/startCoords/stopCoords/step_size, e.g. [['X-Stage',8,10,1],['Y-Stage',13,14,1],['wiregrid','angles.npy']], every entry is [stage,start,stop,step] or [stage,list or .npy file of coordinates]
+scanOrder = None           #order of the scanAxes stages from the outermost to the innermost, None keeps the order of scanAxes (the last stage is swept at every point of the others)
 scanStage = 'ScanStage'    #name of the instrument to use as stage for the scan
 scanReader = 'ScanOsc'     #name of the instrument  to use as reader for the scan     
+scanChannels = [2]         #oscilloscope channels read at every point, e.g. [1,2] reads reference and signal from the same acquisition
+fastFrame = False          #record every point of a line as a FastFrame frame and transfer the line at once (scope must support FastFrame and must not trigger on its own). The frames are taken on forced triggers, so they are not aligned with the pulse and the fixed 4500:5500 window of heatmap.py/replay.py does not apply (they warn), AdaptiveScan refuses it
 stageSettleTime = 0.5       #time to wait for stage to finish movement
-resolution = 100             #This is the resolution of step size of the scan this must be larger than 10^n where n is the number of decimal places in the smallest step size of all axis.
-scanner = Scanner(moduleType,axes,startCoords,stopCoords,step_size,scanStage,scanReader,stageSettleTime,1000)
+pipelined = False          #move the stage to the next point while the scope data of the current point is transferred
+flyVelocity = 1.0          #velocity of the flying stage in a FlyScan in mm/s (deg/s for rotation stages), the scope records a frame every step_size/flyVelocity seconds
+flyPollInterval = 0.02     #interval in s at which the stage position is recorded during a FlyScan to reconstruct the position of every frame
+adaptiveThreshold = 0.5    #AdaptiveScan: refine grid cells with a point above this fraction of the strongest signal (0.5 = half max)
+adaptiveGradient = 0.25    #AdaptiveScan: also refine cells whose corners differ by more than this fraction of the strongest signal
+adaptiveBudget = 2000      #AdaptiveScan: maximum number of points including the coarse pass
+adaptiveLevels = 3         #AdaptiveScan: number of refinement passes after the coarse pass, each halves the step size
+adaptiveWindow = [4500,5500]  #AdaptiveScan: samples of the trace that are integrated into the signal of a point, None for the whole trace
+parallelMoves = False      #move stages whose moves follow each other (e.g. the next row and the return of the column stage) at the same time with one MoveStages action
+serpentine = False         #scan every other line of the inner axes backwards instead of moving them back to the start (saves the flyback moves)
+waitMode = 'fixed'         #'fixed' always sleeps stageSettleTime, 'event' waits for a new scope acquisition after every move and on *OPC? after stopping the scope, sleeping only if the scope does not answer in time
+settleAcquisitions = None  #'event' mode: new acquisitions to wait for after every move, None for 1 or ACQ:NUMAV when the scope averages (so the average holds nothing recorded while moving)
+waitTimeout = 5            #'event' mode: seconds to wait for the acquisitions or *OPC? before falling back to sleeping
+resolution = 100             #not used anymore, the scan points are counted from start to stop in whole steps (stop is included when it lies on the grid)
+scanner = Scanner(moduleType,axes,startCoords,stopCoords,step_size,scanStage,scanReader,stageSettleTime,1000,channels=scanChannels,fastFrame=fastFrame,waitMode=waitMode,settleAcquisitions=settleAcquisitions,waitTimeout=waitTimeout,pipelined=pipelined,serpentine=serpentine,flyVelocity=flyVelocity,flyPollInterval=flyPollInterval,adaptiveThreshold=adaptiveThreshold,adaptiveGradient=adaptiveGradient,adaptiveBudget=adaptiveBudget,adaptiveLevels=adaptiveLevels,adaptiveWindow=adaptiveWindow,scanAxes=scanAxes,scanOrder=scanOrder,parallelMoves=parallelMoves)
+
+######################### Simulation Config #################################################
+#here you can run the experiment against simulated instruments (hardware/simulation.py), nothing has to be connected
+simulate = False           #True replaces the instruments above (the Tektronix oscilloscope and the Kinesis stages) with simulated ones. The ESP300 and PI E-873 controllers are not instruments of this list; to simulate them create ESP300_Control/PI_E873_3QTU with connection_type='simulated'
+simulationSettings = {'latency':0.002,'bandwidth':10e6,'recordLength':10000,'stageVelocity':2.0,'beam':{'center':[9,13.5,0],'waist':0.5,'amplitude':0.4,'noise':0.002}}   #latency of one command in s, bandwidth of the scope transfer in bytes/s, record length in points, stage velocity in mm/s, gaussian beam with its waist at center [X,Y,Z] (waist radius in mm, amplitude and noise in V)
+
+######################### Output Config #####################################################
+#here you can set how the oscilloscope data is written to disk
+stepFileFormat = 'txt'     #format of the per step GetDataOsc files, it can be 'txt','npy' (numpy array),'bin' (flat float64 file) or 'none' to only use OscData.hdf5
+storageMode = 'volts'      #'volts' stores scaled float32 voltages in OscData.hdf5, 'raw' stores the 8/16 bit scope codes and the scaling once (8-16x smaller)
+flushInterval = 100        #number of oscilloscope records after which the data file is flushed to disk, the file is always flushed when the experiment ends
+backgroundWriter = True    #write data on a separate thread so that the scan does not wait for the disk
+writeQueueSize = 16        #number of records that can wait for the disk before the scan is paused, each record holds a full waveform in memory
+profile = False            #record the duration and bytes of every action and VISA transaction, exported to profile_*.csv and profile.hdf5 in the experiment folder
+profileEvents = True       #with profile also export every single action and transaction, not only the summary and histograms per instrument and action/command
+profileLiveInterval = None #with profile print a summary of where the time went every this many seconds while the experiment runs, None for no live summary
+progressInterval = 0.25    #seconds between two updates of the progress line (points done, points/s, ETA and time per phase), None to run without it
 
 ###########################Do not change anything after this point##############################
 def getInstrumentHandler():
-    instHandler = instrumentHandler()
+    instHandler = instrumentHandler(simulationSettings if simulate else None)
     for inst in instruments:
         instHandler.add_instrument(inst)
     return instHandler
 
 def getScanner():
     global scanner
-    return scanner    
+    return scanner
+
+def getOutputSettings():
+    return {'flushInterval':flushInterval,'backgroundWriter':backgroundWriter,'writeQueueSize':writeQueueSize,'stepFileFormat':stepFileFormat,'storageMode':storageMode,'profile':profile,'profileEvents':profileEvents,'profileLiveInterval':profileLiveInterval,'progressInterval':progressInterval}    
 
 
 
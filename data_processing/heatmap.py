@@ -2,15 +2,17 @@ import os
 import matplotlib.pyplot as plt
 import matplotlib.colors as matcols
 from matplotlib import patches
-import h5py
+from oscdata import OscData
 import config
 import numpy as np
 from scipy import stats
 path = 'OscData.hdf5'
-fileh = h5py.File(path, "r")
+fileh = OscData(path)
+if fileh.forced_trigger:
+    print('Warning: the data are FastFrame frames recorded on forced triggers, the window 4500:5500 is not aligned with the pulse')
+ydata = fileh.signal(points=slice(4500,5500))     #one row per recorded step in volts of the last scope channel, read as one contiguous array
 def get_data(count):
-    data = fileh[f"step{count}"]
-    data  = data[14500:15500]
+    data = ydata[count-1]
     #print(data.shape)
     #mid  = max(data)+min(data)/2
     mid = stats.mode(data) 
@@ -23,17 +25,25 @@ def get_data(count):
 marks = np.empty(0)
 count = 1
 steps = []
-axes  = config.axes
 axes_ticks = []
+if fileh.coordinates is not None:
+    #the grid is stored with the data
+    axes = fileh.axes
+    steps = list(fileh.grid_shape)
+    axes_ticks = [np.round(fileh.coordinates[axis],decimals=3) for axis in axes]
+else:
+    axes  = config.axes
+    axis_map = {'X':0,'Y':1,'Z':2}
+    for i in axes:
+        index = axis_map[i]
+        steps.append(int(abs(config.stopCoords[index] - config.startCoords[index])/config.step_size[index]+1))
+        axes_ticks.append(np.round_(np.arange(config.startCoords[index],config.stopCoords[index],0.5),decimals=3))
+        #axes_ticks.append(np.round_(np.arange(13.0,23.0,0.5), decimals = 3))
 print(axes)
-axis_map = {'X':0,'Y':1,'Z':2}
-for i in axes:
-    index = axis_map[i]
-    steps.append(int(abs(config.stopCoords[index] - config.startCoords[index])/config.step_size[index]+1))
-    axes_ticks.append(np.round_(np.arange(config.startCoords[index],config.stopCoords[index],0.5),decimals=3))
-    #axes_ticks.append(np.round_(np.arange(13.0,23.0,0.5), decimals = 3))
 background = get_data(1)
-total_steps = np.prod(steps)
+#adaptive scans store the coordinates of their irregular points instead of a grid
+irregular = fileh.positions is not None and fileh.positions.ndim == 2
+total_steps = len(fileh) if irregular else np.prod(steps)
 for _ in range(total_steps):
     data = get_data(count)-background
     for i in range(len(data)):
@@ -45,42 +55,68 @@ for _ in range(total_steps):
         print(f'{count/total_steps} completed')
     #print(new_temp)
     count+=1
-marks = np.reshape(marks, steps)
+if irregular:
+    #interpolate the irregular points onto a regular grid of the scanned area
+    from scipy.interpolate import griddata
+    gridx = np.linspace(fileh.positions[:,0].min(),fileh.positions[:,0].max(),200)
+    gridy = np.linspace(fileh.positions[:,1].min(),fileh.positions[:,1].max(),200)
+    grid_y,grid_x = np.meshgrid(gridy,gridx)
+    marks = griddata(fileh.positions,marks,(grid_x,grid_y),method='linear',fill_value=0)
+elif fileh.indices is None:
+    marks = np.reshape(marks, steps)
+else:
+    #serpentine scans are not recorded in grid order, put every step back at its grid index
+    grid = np.zeros(steps)
+    grid[tuple(fileh.indices[:total_steps].T)] = marks
+    marks = grid
 fig, ax = plt.subplots()
-plt.xticks(ticks = np.arange(0,100,5),labels=axes_ticks[1],rotation=90)
-plt.yticks(ticks = np.arange(0,100,5),labels= axes_ticks[0])
-maxpower = np.amax(marks)
-hpbw = maxpower/2
-x = 0
-for first in marks:
-    x+=1
-    y=0
-    inside = False
-    for val in first:
-        y+=1
-        if val < hpbw:
-            if inside == True:
-                plt.plot(y,x,'b*')
-                inside = False
-        if val > hpbw:
-            if inside:
-                continue
-            else:
-                inside = True
-                plt.plot(y,x,'g*')
+if irregular:
+    hm = ax.imshow(marks, cmap='CMRmap',norm=matcols.LogNorm(),extent=[gridy[0],gridy[-1],gridx[-1],gridx[0]])
+    #half power contour and the measured points
+    ax.contour(gridy,gridx,marks,levels=[np.amax(marks)/2],colors='g')
+    ax.plot(fileh.positions[:,1],fileh.positions[:,0],'w.',markersize=1)
+    plt.colorbar(hm)
+else:
+    if fileh.coordinates is not None:
+        #at most about 20 labels per axis
+        every = [max(1,step//20) for step in steps]
+        plt.xticks(ticks = np.arange(0,steps[1],every[1]),labels=axes_ticks[1][::every[1]],rotation=90)
+        plt.yticks(ticks = np.arange(0,steps[0],every[0]),labels= axes_ticks[0][::every[0]])
+    else:
+        plt.xticks(ticks = np.arange(0,100,5),labels=axes_ticks[1],rotation=90)
+        plt.yticks(ticks = np.arange(0,100,5),labels= axes_ticks[0])
+    maxpower = np.amax(marks)
+    hpbw = maxpower/2
+    x = 0
+    for first in marks:
+        x+=1
+        y=0
+        inside = False
+        for val in first:
+            y+=1
+            if val < hpbw:
+                if inside == True:
+                    plt.plot(y,x,'b*')
+                    inside = False
+            if val > hpbw:
+                if inside:
+                    continue
+                else:
+                    inside = True
+                    plt.plot(y,x,'g*')
 
-hm = ax.imshow(marks, cmap='CMRmap',norm=matcols.LogNorm())
-#hm = ax.imshow(marks, cmap='CMRmap')
-plt.colorbar(hm)
-#min_val = np.amax(marks)
-#max_val = np.amin(marks)
-#print(min_val,max_val)
-#cbar = fig.colorbar(hm, ticks=[min_val, min_val+max_val/2, max_val])
-#cbar.ax.set_yticklabels(['< -1', '0', '> 1']) 
-#rect = patches.Rectangle((10, 10), 40, 30, linewidth=1,
-   #                      edgecolor='r', facecolor="none")
+    hm = ax.imshow(marks, cmap='CMRmap',norm=matcols.LogNorm())
+    #hm = ax.imshow(marks, cmap='CMRmap')
+    plt.colorbar(hm)
+    #min_val = np.amax(marks)
+    #max_val = np.amin(marks)
+    #print(min_val,max_val)
+    #cbar = fig.colorbar(hm, ticks=[min_val, min_val+max_val/2, max_val])
+    #cbar.ax.set_yticklabels(['< -1', '0', '> 1']) 
+    #rect = patches.Rectangle((10, 10), 40, 30, linewidth=1,
+       #                      edgecolor='r', facecolor="none")
   
-# Add the patch to the Axes
-#ax.add_patch(rect)
+    # Add the patch to the Axes
+    #ax.add_patch(rect)
 
 plt.show()
\ No newline at end of file
@@ -0,0 +1,79 @@
+import h5py
+import numpy as np
+
+#Reads OscData.hdf5 written by utils/datawriter.py. Both storage modes are returned as volts,
+#for 'raw' files only the rows that are indexed are read and scaled.
+#Files with several channels per step are indexed as [step,channel,point], signal() reads [step,point] of one channel
+#(the last one by default) from files with one or several channels.
+#indices holds the grid index of every step when the scan stored them (e.g. serpentine scans), otherwise None.
+#axes and coordinates (axis name -> array) describe the scan grid when the scan stored it, otherwise they are None,
+#point(step) returns the coordinates of one step.
+#forced_trigger is True when the steps are FastFrame frames recorded on forced triggers (fastFrame or FlyScan), their
+#samples are not aligned with the trigger of the pulse, so a fixed window like 4500:5500 does not hold the pulse.
+#positions holds the measured position of the flying stage at every step of a FlyScan, otherwise None.
+class OscData():
+    def __init__(self,path='OscData.hdf5'):
+        self._file = h5py.File(path,"r")
+        self.storageMode = self._file.attrs.get('storageMode','volts')
+        if self.storageMode == 'raw':
+            self._data = self._file['codes']
+            self.preamble = {key:self._data.attrs[key] for key in ['YMU','YOF','YZE','XINC','XZE']}
+        else:
+            self._data = self._file['ydata']
+            self.preamble = None
+        self.shape = self._data.shape
+        self.channels = list(self._data.attrs['channels']) if 'channels' in self._data.attrs else None
+        self.forced_trigger = bool(self._file.attrs.get('forcedTrigger',False))
+        self.indices = self._file['indices'][:] if 'indices' in self._file else None
+        self.positions = self._file['positions'][:] if 'positions' in self._file else None
+        self.axes = None
+        self.coordinates = None
+        if 'coordinates' in self._file:
+            self.axes = list(self._file['coordinates'].attrs['axes'])
+            self.coordinates = {axis:self._file['coordinates'][axis][:] for axis in self.axes}
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    def _yScale(self,key,index):
+        value = self.preamble[key]
+        if self.channels is None:
+            return value
+        #one value per channel, select the indexed channels and broadcast them along the points
+        index = index if isinstance(index,tuple) else (index,)
+        value = np.asarray(value)[index[1] if len(index)>1 else slice(None)]
+        if np.ndim(value):
+            value = np.reshape(value,(-1,1))
+        return value
+
+    def __getitem__(self,index):
+        data = self._data[index]
+        if self.storageMode == 'raw':
+            data = self._yScale('YZE',index)+((data-self._yScale('YOF',index))*self._yScale('YMU',index))
+        return data
+
+    #steps and points of one channel, channel is the position in channels and ignored for single channel files
+    def signal(self,steps=slice(None),points=slice(None),channel=-1):
+        if self.channels is None:
+            return self[steps,points]
+        return self[steps,channel,points]
+
+    #grid shape of the scan, one entry per axis
+    @property
+    def grid_shape(self):
+        return tuple(len(self.coordinates[axis]) for axis in self.axes)
+
+    def point(self,step):
+        if self.positions is not None and self.positions.ndim == 2:
+            return self.positions[step].tolist()
+        index = self.indices[step] if self.indices is not None else np.unravel_index(step,self.grid_shape)
+        return [float(self.coordinates[axis][i]) for axis,i in zip(self.axes,index)]
+
+    @property
+    def time_base(self):
+        if self.storageMode == 'raw':
+            return self.preamble['XZE']+self.preamble['XINC']*np.arange(0,self._data.shape[-1])
+        return self._file['time_base'][:]
+
+    def close(self):
+        self._file.close()
@@ -3,13 +3,15 @@ import numpy as np
 import pyqtgraph as pg 
 import os
 import config
-import h5py
+from oscdata import OscData
 from scipy import stats
 path = 'OscData.hdf5'
-fileh = h5py.File(path, "r")
+fileh = OscData(path)
+if fileh.forced_trigger:
+    print('Warning: the data are FastFrame frames recorded on forced triggers, the window 4500:5500 is not aligned with the pulse')
+ydata = fileh     #one row per recorded step in volts, see oscdata.py
 def get_data(count):
-    data = fileh[f"step{count}"]
-    data  = data[14500:15500]
+    data = ydata.signal(count-1,slice(4500,5500))
     #print(data.shape)
     #mid  = max(data)+min(data)/2
     mid = stats.mode(data) 
@@ -77,17 +79,22 @@ def update():
     a = get_data(count)
     #super_threshold_indices = a < 0.000001
     #a[super_threshold_indices] = 0
-    new = iter.step(0)
-    print(new)
     p6.legend.removeItem(plotItem)
-    p6.legend.addItem(plotItem, f"x={new[0]},y={new[1]}")
+    if fileh.coordinates is not None:
+        #position of the step from the grid stored with the data
+        new = fileh.point(count-1)
+        p6.legend.addItem(plotItem, ','.join(f"{axis}={coord}" for axis,coord in zip(fileh.axes,new)))
+    else:
+        new = iter.step(0)
+        p6.legend.addItem(plotItem, f"x={new[0]},y={new[1]}")
+    print(new)
     curve.setData(a-background)
 
     #if ptr == 0:
      #   p6.enableAutoRange('', False)  ## stop auto-scaling after the first data set is plotted
     count += 1
     print(count)
-    if count >10201:
+    if count >len(fileh):
         count = 1
 if __name__ == "__main__":
     timer = QtCore.QTimer() 
@@ -1,7 +1,12 @@
-import datetime,os
-from config import getInstrumentHandler,getScanner
+import datetime,os,threading,time
+from config import getInstrumentHandler,getScanner,getOutputSettings
 from utils.action import Action
-import h5py
+from utils.modules import ScanPlan
+from utils.datawriter import HDF5Writer,BackgroundWriter
+from utils.scheduler import ActionScheduler
+from utils.adaptive import ScanFeedback
+from utils.profiling import Profiler
+from utils.progress import ProgressReporter
 import numpy as np
 import shutil
 
@@ -14,25 +19,49 @@ def makeDir(filepath,count):
     return filePath
 
 
+#directory of this file, the data_processing scripts and config.py are copied from here
+baseDirectory = os.path.dirname(os.path.realpath(__file__))
+
+
 class ExperimentOutput():
-    def __init__(self,experimentName):
+    #outputRoot replaces the outputs folder and settings the output settings of config.py, e.g. for benchmarks/scan_benchmark.py
+    def __init__(self,experimentName,outputRoot=None,settings=None):
         self._metadata = experimentName
-        directory = os.path.join(os.path.dirname(os.path.realpath(__file__)),os.path.join('outputs',experimentName+'-'+str(datetime.datetime.now().date())))
+        if outputRoot is None:
+            outputRoot = os.path.join(baseDirectory,'outputs')
+        directory = os.path.join(outputRoot,experimentName+'-'+str(datetime.datetime.now().date()))
         self._directory = makeDir(directory,0)
         self._mainModuleFile = os.path.join(self._directory,'MainExp.txt')
         self._actionCount = 1
         self.create_config()
         self._fileNameh = os.path.join(self._directory,'OscData.hdf5')
+        self._settings = settings if settings is not None else getOutputSettings()
+        if self._settings['stepFileFormat'] not in ['txt','npy','bin','none']:
+            raise ValueError(f"Unknown step file format {self._settings['stepFileFormat']}")
+        self._dataActions = ['GET_DATA','GET_FRAMES']
+        #trajectory of the last FlyStage and trigger times of the last TRIGGER_FRAMES of a fly scan
+        self._trajectory = None
+        self._triggerTimes = None
+        #called with every action and its output as soon as it has run, before it is queued for the disk
+        self._listeners = []
+        self._writer = None
+        self._background = None
+        self._lock = threading.Lock()
+        #times of the actions and VISA transactions, exported to the experiment folder when the output is closed
+        self.profiler = Profiler(self._settings.get('profileEvents',True)) if self._settings.get('profile') else None
+        self.profileLiveInterval = self._settings.get('profileLiveInterval')
+        #seconds between two updates of the progress line, None for no progress line
+        self.progressInterval = self._settings.get('progressInterval')
 
     def create_config(self):
     ############add files that need to be copied to new folder of experiment#########
-        files_to_copy = ["replay.py","replay.bat","heatmap_plot.bat","heatmap.py"]
+        files_to_copy = ["replay.py","replay.bat","heatmap_plot.bat","heatmap.py","oscdata.py"]
         for file in files_to_copy:
-            shutil.copyfile(os.path.join("data_processing",file), os.path.join(self._directory,file))
+            shutil.copyfile(os.path.join(baseDirectory,"data_processing",file), os.path.join(self._directory,file))
     ###############copying the config file###########################################
         filename = os.path.join(self._directory,"config.py")
         file = open(filename,"a")
-        configfile = open("config.py","r")
+        configfile = open(os.path.join(baseDirectory,"config.py"),"r")
         ignore_lines = ["","from","def","scanner"]
         file.writelines("from ctypes import * \n")
         for i in configfile.readlines():
@@ -41,25 +70,100 @@ class ExperimentOutput():
         file.close()
         configfile.close()
     
-###   This is where all the output is handled and this is where we change the data logging and storing modules
+    def open(self,expectedSteps=None,coordinates=None):
+        #every further run of the same output gets its own OscData_<n>.hdf5 next to the first one
+        run = 1
+        while os.path.exists(self._fileNameh):
+            self._fileNameh = os.path.join(self._directory,f'OscData_{run}.hdf5')
+            run += 1
+        self._writer = HDF5Writer(self._fileNameh,expectedSteps,self._settings['flushInterval'],self._settings['storageMode'],coordinates)
+        if self._settings['backgroundWriter']:
+            self._background = BackgroundWriter(self._writeStepData,self._settings['writeQueueSize'])
+
+    def close(self):
+        try:
+            if self._background is not None:
+                self._background.close()
+        finally:
+            self._background = None
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self.profiler is not None:
+                self.profiler.export(self._directory)
+
+    def addListener(self,listener):
+        self._listeners.append(listener)
+
     def addStepData(self,action,output):
-        actionData = 'TimeStamp:'+str(datetime.datetime.now())+', Instrument:'+action._instName+', Action Type:'+action._actionType+', Action Data:'+str(action._actionData)
+        timeStamp = datetime.datetime.now()
+        for listener in self._listeners:
+            listener(action,output)
+        #the scheduler calls this from several threads at once
+        with self._lock:
+            if self._writer is None:
+                self.open()
+            if self._background is not None:
+                self._background.put(timeStamp,action,output)
+            else:
+                self._writeStepData(timeStamp,action,output)
+
+    # one file per GET_DATA step next to OscData.hdf5, format set by stepFileFormat in config.py
+    def _writeStepFile(self,fileName,outputData):
+        fileFormat = self._settings['stepFileFormat']
+        filePath = os.path.join(self._directory,fileName)
+        #one row per channel, so several channels become extra columns/rows after the time base
+        ydata = np.atleast_2d(outputData[1])
+        if fileFormat == 'txt':
+            file = open(filePath+'.txt',"a")
+            file.write(''.join([' , '.join([str(value) for value in row])+'\n' for row in zip(outputData[0],*ydata)]))
+            file.close()
+        elif fileFormat == 'npy':
+            np.save(filePath+'.npy',np.vstack([outputData[0],ydata]))
+        elif fileFormat == 'bin':
+            #flat float64 file with the time row followed by one voltage row per channel, read back with
+            #np.memmap(filePath,dtype='f8',mode='r').reshape(1+numChannels,-1)
+            np.vstack([outputData[0],ydata]).astype('f8').tofile(filePath+'.bin')
+        else:
+            return False
+        return True
+
+    #position of the flying stage at every frame of a fly scan line, interpolated from the polled trajectory at the trigger times
+    def _framePositions(self,numFrames):
+        positions = [None]*numFrames
+        if self._trajectory is not None and self._triggerTimes is not None and len(self._triggerTimes) == numFrames:
+            positions = np.interp(self._triggerTimes,self._trajectory[:,0],self._trajectory[:,1])
+        self._trajectory = None
+        self._triggerTimes = None
+        return positions
+
+###   This is where all the output is handled and this is where we change the data logging and storing modules
+    def _writeStepData(self,timeStamp,action,output):
+        actionData = 'TimeStamp:'+str(timeStamp)+', Instrument:'+action._instName+', Action Type:'+action._actionType+', Action Data:'+str(action._actionData)
         if output[0]:
             actionData= actionData+': Success'
-            if output[1]:   
-                fileName = os.path.join(self._directory,'GetDataOsc'+str(datetime.datetime.now().date())+'_'+str(self._actionCount)+'.txt')
-                actionData= actionData+'File:GetDataOsc'+str(datetime.datetime.now().date())+'_'+str(self._actionCount)
-                outputData = output[1][0]
-                h5data = np.array([outputData[0],outputData[1]])
-                fileh = h5py.File(self._fileNameh, "a")
-                fileh.create_dataset(f"step-{self._actionCount}", h5data.size, dtype='f',data = h5data)
-                print(outputData)
-                file = open(fileName,"a")
-                for i in  range(len(outputData[0])):
-                    file.writelines(str(outputData[0][i])+' , '+str(outputData[1][i])+'\n')
-                file.close()
-                fileh.close()
-                self._actionCount +=1
+            if action._actionType == 'FlyStage':
+                self._trajectory = output[1][0]
+            if action._actionType == 'TRIGGER_FRAMES':
+                self._triggerTimes = output[1][0]
+            if output[1] and action._actionType in self._dataActions:
+                #GET_DATA returns one record, GET_FRAMES one record per frame, each record is one step
+                indices = action._index if action._index is not None else [None]*len(output[1])
+                if action._actionType == 'GET_FRAMES':
+                    #the frames are recorded on forced triggers, so the pulse is not at a fixed sample of the trace
+                    self._writer.setAttribute('forcedTrigger',True)
+                if action._position is not None:
+                    positions = action._position
+                elif action._actionType == 'GET_FRAMES':
+                    positions = self._framePositions(len(output[1]))
+                else:
+                    positions = [None]*len(output[1])
+                for outputData,index,position in zip(output[1],indices,positions):
+                    self._writer.write(outputData,index,position)
+                    fileName = 'GetDataOsc'+str(timeStamp.date())+'_'+str(self._actionCount)
+                    if self._writeStepFile(fileName,outputData):
+                        actionData= actionData+'File:'+fileName
+                    self._actionCount +=1
 
                 
         else:
@@ -74,35 +178,94 @@ class ExperimentOutput():
 
 
 class Experiment():
-    def __init__(self,experimentName,experimentMetaData=None):
+    #instHandler, scanner and output default to the ones of config.py
+    def __init__(self,experimentName,experimentMetaData=None,instHandler=None,scanner=None,output=None):
         self._metaData = experimentMetaData
-        self._output = ExperimentOutput(experimentName)
+        self._output = output if output is not None else ExperimentOutput(experimentName)
         self._actions = []
-        self.instHandler = getInstrumentHandler()
-        self.scanner = getScanner()
+        self.instHandler = instHandler if instHandler is not None else getInstrumentHandler()
+        self.scanner = scanner if scanner is not None else getScanner()
+        self._output.addListener(self.scanner.observe)
 
     def loadScanner(self):
         self._actions = self.scanner.compile()
+        for axis,coords in self.scanner.coordinates().items():
+            print(f'{axis}: {len(coords)} points from {coords[0]} to {coords[-1]}')
     
     def printActions(self):
         for action in self._actions:
             print(action)
 
-    def addAction(self,instName,actionType,actionData):
-        self._actions.append(Action(instName,actionType,actionData))
+    #dependency graph of the plan and how long it should take when actions on different resources overlap
+    def printSchedule(self):
+        scheduler = ActionScheduler(self.instHandler)
+        print(scheduler.describe(self._actions))
+        estimate = scheduler.estimate(self._actions)
+        print(f"Estimated duration {estimate['total']:.1f} s ({estimate['serial']:.1f} s one action at a time), critical path: {estimate['criticalPath']}")
+
+    #waitFor lists the instruments the action has to wait for on the scheduler, see utils/action.py,
+    #e.g. [] rotates the wiregrid while the X and Y stages move
+    def addAction(self,instName,actionType,actionData,waitFor=None):
+        self._actions.append(Action(instName,actionType,actionData,waitFor))
 
     def addActionFunction(self,actionfunc):
         self._actions = actionfunc()
 
+    #number of oscilloscope records the actions will produce, used to pre-size the data file
+    def countSteps(self):
+        count = 0
+        for action in self._actions:
+            if action._actionType == 'GET_DATA':
+                count += 1
+            if action._actionType == 'GET_FRAMES':
+                count += action._actionData[1]
+        return count
+
     def runExperiment(self):
-        for currAction in self._actions:
-            #try:## add level of failure as well , by returning strings
-            print(currAction)
-            currOutput  = self.instHandler.runAction(currAction)
-            print(f'Output for action {currAction._actionType} with data {currAction._actionData} is {currOutput}')
-            self._output.addStepData(currAction,currOutput)
-            #except:
-              #  print(f"Action {currAction._actionType} for instrument {currAction._instName} failed to execute" )
+        #a scan plan knows its points without being walked (an adaptive scan only an upper bound), a list is counted
+        steps = self._actions.totalPoints() if hasattr(self._actions,'totalPoints') else self.countSteps()
+        #the grid and the adaptive feedback belong to the scanner, a plan written with addAction/addActionFunction has neither
+        scanned = isinstance(self._actions,ScanPlan) and self._actions.scanner is self.scanner
+        self._output.open(steps,self.scanner.coordinates() if scanned else None)
+        if scanned and self.scanner.adaptive:
+            #the refinement passes of an adaptive scan are planned from the results of the running scan
+            self.scanner.feedback = ScanFeedback(self.scanner.adaptiveWindow)
+        profiler = self._output.profiler
+        if profiler is not None:
+            self.instHandler.setProfiler(profiler)
+            if self._output.profileLiveInterval:
+                profiler.startLive(self._output.profileLiveInterval)
+        progress = None
+        if self._output.progressInterval:
+            progress = ProgressReporter(steps,self._output.progressInterval)
+        try:
+            #plans with dependencies between actions run on the scheduler, everything else one action at a time
+            if hasattr(self._actions,'hasDependencies'):
+                dependencies = self._actions.hasDependencies()
+            else:
+                dependencies = self.scanner.pipelined or any(action._waitFor is not None for action in self._actions)
+            if dependencies:
+                ActionScheduler(self.instHandler,self._output,progress=progress).run(self._actions)
+            else:
+                for currAction in self._actions:
+                    #try:## add level of failure as well , by returning strings
+                    start = time.perf_counter()
+                    currOutput  = self.instHandler.runAction(currAction)
+                    end = time.perf_counter()
+                    self._output.addStepData(currAction,currOutput)
+                    if progress is not None:
+                        progress.done(currAction,currOutput,end-start,time.perf_counter()-end)
+                    #except:
+                      #  print(f"Action {currAction._actionType} for instrument {currAction._instName} failed to execute" )
+        finally:
+            self.scanner.feedback = None
+            if progress is not None:
+                progress.finish()
+            if profiler is not None:
+                profiler.stopLive()
+                self.instHandler.setProfiler(None)
+                print(profiler.summary())
+            self._output.close()
 
 if __name__=="__main__":
     exp = Experiment('myfirstday')
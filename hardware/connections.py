@@ -6,13 +6,28 @@ Note: Seems better to let the user encode/decode to utf-8, incase
     data sent/retured to the instument should be in bytes.
 '''
 from __future__ import print_function 
-import serial
-import serial.tools.list_ports 
-import chardet
 import time
-import vxi11
-import visa
 import socket
+# The instrument libraries are only needed by the connections that use
+# them, so the simulated instruments also run without them
+try:
+    import serial
+    import serial.tools.list_ports 
+except ImportError:
+    serial = None
+try:
+    import chardet
+except ImportError:
+    chardet = None
+try:
+    import vxi11
+except ImportError:
+    vxi11 = None
+try:
+    import visa
+except ImportError:
+    visa = None
+from . import simulation
 
 
 def select_connection(connection_type: str, **connection_kwargs):
@@ -37,7 +52,8 @@ def select_connection(connection_type: str, **connection_kwargs):
         connection_class = {
             'test': TestClass,
             'serial': SerialConnection,
-            'ethernet': EthernetConnection
+            'ethernet': EthernetConnection,
+            'simulated': simulation.simulated_connection
         }
         return connection_class[connection_type](**connection_kwargs)
 
@@ -165,12 +181,58 @@ class SerialConnection():
             return self.read_all(raw_bytes=False)
 
 
+class ProfiledVISAResource:
+    """Wraps a VISA resource and reports every write and query to
+    record(kind, instrument, name, start, end, num_bytes), with the command
+    header as name and the time.perf_counter() times. A query is timed from
+    its write to the end of read_raw. Everything else is passed on to the
+    resource. Only used while profiling, see VISAConnection.set_profiler.
+    """
+
+    def __init__(self, resource, record, instrument):
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, '_record', record)
+        object.__setattr__(self, '_instrument', instrument)
+        object.__setattr__(self, '_query', None)
+
+    def write(self, command):
+        start = time.perf_counter()
+        result = self.resource.write(command)
+        header = command.strip().split(' ', 1)[0]
+        if header.endswith('?'):
+            # completed by read_raw
+            object.__setattr__(self, '_query', (header, start, len(command)))
+        else:
+            self._record('visa', self._instrument, header, start,
+                         time.perf_counter(), len(command))
+        return result
+
+    def read_raw(self, *args, **kwargs):
+        start = time.perf_counter()
+        header, start, sent = self._query or ('read_raw', start, 0)
+        object.__setattr__(self, '_query', None)
+        reply = self.resource.read_raw(*args, **kwargs)
+        self._record('visa', self._instrument, header, start,
+                     time.perf_counter(), sent + len(reply))
+        return reply
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def __setattr__(self, name, value):
+        # e.g. the timeout
+        setattr(self.resource, name, value)
+
+
 class VISAConnection:
     """VISA connection over ethernet."""
 
-    def __init__(self, resource_name):
+    def __init__(self, resource_name, resource_manager=None):
         self.resource_name = resource_name
-        self.resource_manager = visa.ResourceManager()
+        # e.g. simulation.SimulatedResourceManager instead of the VISA library
+        if resource_manager is None:
+            resource_manager = visa.ResourceManager()
+        self.resource_manager = resource_manager
         self.connection = self.resource_manager.open_resource(self.resource_name)
         try:
             self.connection.write('*IDN?')
@@ -191,6 +253,15 @@ class VISAConnection:
         self.send(command)
         return self.connection.read_raw().decode().rstrip()
 
+    def set_profiler(self, record=None, instrument=None):
+        """Reports every write and query to record (see
+        ProfiledVISAResource) until it is called with record None. """
+        if isinstance(self.connection, ProfiledVISAResource):
+            self.connection = self.connection.resource
+        if record is not None:
+            self.connection = ProfiledVISAResource(
+                self.connection, record, instrument or self.resource_name)
+
 
 class EthernetConnection:
     def __init__(
@@ -4,28 +4,56 @@ import sys
 import os
 from ctypes import *
 from . import motion_controllers
-from .oscilloscopes import Tektronix_DPO4102B
+from . import simulation
+from .oscilloscopes import Tektronix_DPO4102B,stack_waveforms
 import datetime
 from time import sleep
 
 # instrument list is like a dictionary , where key is the name of instrument and value is instrument parameters,first parameter is the type of instrument.
+# simulationSettings replaces the oscilloscopes and Kinesis stages with simulated ones, see hardware/simulation.py
 class instrumentHandler():
-    def __init__(self):
+    def __init__(self,simulationSettings=None):
         self._inst = {}
         self._outputData = None
         self._inst['SYSTEM'] = System()
+        self._profiler = None
+        self._bench = None
+        if simulationSettings is not None:
+            self._bench = simulation.configure(simulationSettings)
         
     def add_instrument(self,instData):
         if instData[0] == 'KinesisController':
-            self._inst[instData[1]] = thorlabsKinesisMotionController(instData[2])
+            self._inst[instData[1]] = thorlabsKinesisMotionController(instData[2],self._bench)
 
         if instData[0] == 'Tektronix_DPO4102B':
-            self._inst[instData[1]] = techtronixOsc(instData[2]['ipAddress'])
+            self._inst[instData[1]] = techtronixOsc(instData[2]['ipAddress'],self._bench)
         
     def runAction(self,action):
         if action._actionType in self._inst[action._instName].getActions():
             return(self._inst[action._instName].doAction(action))
 
+    #records every action and VISA transaction in profiler (utils/profiling.py), None stops it. runAction is only
+    #replaced while profiling, so an experiment without a profiler runs exactly the code above
+    def setProfiler(self,profiler):
+        self._profiler = profiler
+        if profiler is None:
+            self.__dict__.pop('runAction',None)
+        else:
+            self.runAction = self._profiledRunAction
+        for instName,inst in self._inst.items():
+            if hasattr(inst,'setProfiler'):
+                inst.setProfiler(profiler,instName)
+
+    def _profiledRunAction(self,action):
+        return self._profiler.timeAction(action._instName,action._actionType,type(self).runAction,self,action)
+
+    #resources an action occupies while it runs, the scheduler runs actions on different resources at the same time
+    def getResources(self,action):
+        inst = self._inst[action._instName]
+        if hasattr(inst,'getResources'):
+            return [(action._instName,part) for part in inst.getResources(action)]
+        return [(action._instName,None)]
+
 
 class System():
     def __init__(self):
@@ -46,22 +74,28 @@ class System():
 
 #FutureWork:This class just needs to be wrapper class for a lower level functionality, so if possible the refernce to dll directory should be moved to a lower level layer.
 class thorlabsKinesisMotionController():
-    def __init__(self,autoCreationData): # stageDate = [[stageName,stageType,serialNumber,stageCoord],[...],[...],..]{createStages,stageData,homeStages}
+    def __init__(self,autoCreationData,bench=None): # stageDate = [[stageName,stageType,serialNumber,stageCoord],[...],[...],..]{createStages,stageData,homeStages}
         #os.chdir(r"C:\Program Files\Thorlabs\Kinesis")
         #self._lib = cdll.LoadLibrary("Thorlabs.MotionControl.KCube.DCServo.dll")
         #self._lib.TLI_BuildDeviceList()
         self._stageData = {}
         self._stages = {}
         self._axis = {}
-        self._actions =['MoveToCoords','MoveStage']
+        self._actions =['MoveToCoords','MoveStage','MoveStages','SetVelocity','FlyStage']
         if autoCreationData['createStages']:
-            for stage in autoCreationData['stageData']:
-                if autoCreationData['homeStages']:
-                    self._stages[stage[0]] = (motion_controllers.KinesisController(serialNumber=stage[2], stageType=stage[1], stageName=stage[0], HomeStage=True))
-                    self._axis[stage[3]] = stage[0]
-                else:
-                    self._stages[stage[0]] = (motion_controllers.KinesisController(serialNumber=stage[2], stageType=stage[1], stageName=stage[0], HomeStage=False))
-                    self._axis[stage[3]] = stage[0]
+            #all stages are opened at the same time, stages that are already open in this process are reused
+            stageData = autoCreationData['stageData']
+            if bench is None:
+                session = motion_controllers.KinesisSession.get()
+            else:
+                session = motion_controllers.KinesisSession(lib=bench.kinesis_lib())
+            devices = session.open_devices([{'serialNumber':stage[2],'stageType':stage[1],'stageName':stage[0],'HomeStage':autoCreationData['homeStages']} for stage in stageData])
+            for stage,device in zip(stageData,devices):
+                self._stages[stage[0]] = device
+                self._axis[stage[3]] = stage[0]
+                #the simulated beam follows the X, Y and Z stages
+                if bench is not None:
+                    bench.add_axis(stage[3],device.get_position)
     
 
     def addStage(self,stageName,stageType):
@@ -85,10 +119,22 @@ class thorlabsKinesisMotionController():
         self._axis[axis] = stageName
 
 
+    #all stages move at the same time, see motion_controllers.move_devices
+    def moveStages(self,stageNames,positions):
+        motion_controllers.move_devices([(self._stages[stageName],position) for stageName,position in zip(stageNames,positions)])
+
     def moveToCoords(self,coords):
-        self._stages[self._axis['X']].move_device(position=coords[0])
-        self._stages[self._axis['Y']].move_device(position=coords[1])
-        self._stages[self._axis['Z']].move_device(position=coords[2])
+        self.moveStages([self._axis['X'],self._axis['Y'],self._axis['Z']],coords[:3])
+
+    #every stage has its own controller, so moves of different stages can run at the same time
+    def getResources(self,action):
+        if action._actionType in ['MoveStage','SetVelocity','FlyStage']:
+            return [action._actionData[0]]
+        if action._actionType=='MoveStages':
+            return list(action._actionData[0])
+        if action._actionType=='MoveToCoords':
+            return [self._axis[axis] for axis in ['X','Y','Z'] if axis in self._axis]
+        return [None]
 
     def doAction(self,action):
         if action._actionType=='MoveToCoords':
@@ -103,6 +149,29 @@ class thorlabsKinesisMotionController():
                 return [True,[action._actionData[1][0]]]
             except:
                 return [False,[]]
+        #MoveStages [[stageName,...],[position,...]] moves several stages at the same time
+        if action._actionType=='MoveStages':
+            try:
+                self.moveStages(action._actionData[0],action._actionData[1])
+                return [True,list(action._actionData[1])]
+            except:
+                return [False,[]]
+        #SetVelocity [stageName,velocity,acceleration] sets the speed of following moves, a velocity of None restores the original speed
+        if action._actionType=='SetVelocity':
+            try:
+                if action._actionData[1] is None:
+                    self._stages[action._actionData[0]].restore_velocity()
+                else:
+                    self._stages[action._actionData[0]].set_velocity(*action._actionData[1:])
+                return [True,[]]
+            except:
+                return [False,[]]
+        #FlyStage [stageName,[position],pollInterval] moves without stopping and returns the polled (time,position) trajectory
+        if action._actionType=='FlyStage':
+            try:
+                return [True,[self._stages[action._actionData[0]].fly_device(action._actionData[1][0],action._actionData[2])]]
+            except:
+                return [False,[]]
 
     
     def getActions(self):
@@ -111,12 +180,14 @@ class thorlabsKinesisMotionController():
 
 
 class techtronixOsc():
-    def __init__(self,ipAddress):
+    def __init__(self,ipAddress,bench=None):
         self._ipAddress = ipAddress
-        self._osc = Tektronix_DPO4102B(self._ipAddress)
+        self._osc = Tektronix_DPO4102B(self._ipAddress,None if bench is None else bench.resource_manager())
         self._maxNumOscPoints = self._osc.get_horizontal_record_length()
         self._oscConnected = True
-        self._actions = ['SET_ACQ_MODE','GET_DATA','SET_ACQ_STATE','GET_ACQ_PARAMS']
+        #acquisitions a WAIT_ACQ without a count waits for, read from the scope once and again after SET_ACQ_MODE
+        self._settleAcquisitions = None
+        self._actions = ['SET_ACQ_MODE','GET_DATA','SET_ACQ_STATE','GET_ACQ_PARAMS','REFRESH_PREAMBLE','ARM_TRANSFER','START_FRAMES','TRIGGER_FRAME','TRIGGER_FRAMES','GET_FRAMES','STOP_FRAMES','WAIT_READY','WAIT_ACQ']
     #mode = enum('AVE',..)
     #numOscAverages is a part of optional arguments which can be added depending upon the required parameters for a mode
     def doAction(self,action):
@@ -148,23 +219,127 @@ class techtronixOsc():
                 return [True,[actionData]]
             except:
                 return [False,[]]
+
+        #use after changing the scope scale from the front panel, the preamble is queried again with the next GET_DATA
+        if action._actionType == 'REFRESH_PREAMBLE':
+            try:
+                self._osc.invalidate_preamble()
+                self._osc.reset_transfer_config()
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        if action._actionType == 'ARM_TRANSFER':
+            try:
+                self.armTransfer(action._actionData[0])
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        #FastFrame: START_FRAMES [count] arms the sequence, TRIGGER_FRAME records one frame at the current position
+        #and GET_FRAMES [channel,count] transfers all frames at once, returning one record per frame
+        if action._actionType == 'START_FRAMES':
+            try:
+                self._osc.start_frames(action._actionData[0])
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        if action._actionType == 'TRIGGER_FRAME':
+            try:
+                self._osc.force_trigger()
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        #TRIGGER_FRAMES [count,interval] records count frames interval seconds apart during a fly scan, returns their time stamps
+        if action._actionType == 'TRIGGER_FRAMES':
+            try:
+                return [True,[self._osc.trigger_frames(action._actionData[0],action._actionData[1])]]
+            except:
+                return [False,[]]
+
+        if action._actionType == 'GET_FRAMES':
+            try:
+                return [True,self.getFrames(action._actionData[0],action._actionData[1])]
+            except:
+                return [False,[]]
+
+        #WAIT_READY [timeout,fallbackTime] waits on *OPC?, WAIT_ACQ [count,timeout,fallbackTime] waits for count new acquisitions
+        #(None for as many as the scope averages, so the average holds no record from before), both sleep for fallbackTime instead if the scope does not answer in time
+        if action._actionType == 'WAIT_READY':
+            try:
+                self.waitReady(action._actionData[0],action._actionData[1])
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        if action._actionType == 'WAIT_ACQ':
+            try:
+                self.waitAcquisitions(action._actionData[0],action._actionData[1],action._actionData[2])
+                return [True,[]]
+            except:
+                return [False,[]]
+
+        if action._actionType == 'STOP_FRAMES':
+            try:
+                self._osc.disable_fastframe()
+                self._osc.set_runstop()
+                return [True,[]]
+            except:
+                return [False,[]]
         
 
     def setAcqMode(self,AcqMode,numOscAverages):
         if self._oscConnected:
             self._osc.set_acquisition_mode(mode=AcqMode)
             self._osc.set_number_averages(averages=numOscAverages)
+            self._settleAcquisitions = None
 
     def setAcqState(self,AcqState):
         if self._oscConnected:
             self._osc.set_acquisition_state(state=AcqState)
 
+    #sends the CURVE? settings once, GET_DATA with the same channel then only sends CURVE?
+    def armTransfer(self,channel):
+        if isinstance(channel,(list,tuple)):
+            channel = channel[0]
+        self._osc.arm_transfer(channel)
+
+    #channel can be a single channel or a list of channels, a list is read from the same acquisition and stacked as (channel x point)
     def getData(self,channel):
-        return(self._osc.get_data(channel))
+        if isinstance(channel,(list,tuple)):
+            return(self._osc.get_multi_waveform(channel))
+        return(self._osc.get_waveform(channel))
+
+    def waitReady(self,timeout,fallbackTime):
+        if not self._osc.wait_operation_complete(timeout):
+            sleep(fallbackTime)
+
+    def waitAcquisitions(self,count,timeout,fallbackTime):
+        try:
+            if count is None:
+                if self._settleAcquisitions is None:
+                    self._settleAcquisitions = self._osc.get_settle_acquisitions()
+                count = self._settleAcquisitions
+            ready = self._osc.wait_for_acquisitions(count,timeout)
+        except Exception:
+            ready = False
+        if not ready:
+            sleep(fallbackTime)
+
+    def getFrames(self,channel,count):
+        if isinstance(channel,(list,tuple)):
+            frames = [self._osc.get_frames(ch,count) for ch in channel]
+            return [stack_waveforms(list(frame),channel) for frame in zip(*frames)]
+        return self._osc.get_frames(channel,count)
 
     def getActions(self):
         return self._actions
 
+    def setProfiler(self,profiler,instName):
+        self._osc.set_profiler(None if profiler is None else profiler.record,instName)
+
     def getAcqParams(self):
         return(self._osc.query_all_acquisition())
     ## def querry busy():
\ No newline at end of file
@@ -11,7 +11,9 @@ import time
 import re
 import math
 import os
+import threading
 from ctypes import *
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 # Custom packages
@@ -184,6 +186,10 @@ class ESP300_Control(_MotionControllerTemplate):
             },
             'visa': {
                 'resource_name': 'GPIB0::1::INSTR',
+            },
+            'simulated': {
+                'controller': 'ESP300',
+                'terminating_char': '\n',
             }
         }
         _precision = 0.001
@@ -467,6 +473,10 @@ class PI_E873_3QTU(_MotionControllerTemplate):
                 'port': 23,
                 'timeout': 3,
                 'buffersize': 1024,
+            },
+            'simulated': {
+                'controller': 'PI_E873',
+                'terminating_char': '\n',
             }
         }
         self.connection = self.make_connection()
@@ -1118,16 +1128,116 @@ class APTController:
         self.find_home_position()
 
 
-class KinesisController:
-    def __init__(self, serialNumber=None, HomeStage=False, stageName=None, stageType='linear', path_kinesis_install=r"C:\Program Files\Thorlabs\Kinesis"):
+_moveWaiters = None
 
-        os.chdir(path_kinesis_install)
-        self.name = "Thorlabs.MotionControl.KCube.DCServo.dll"
-        self.stageName = stageName
-        self.lib = cdll.LoadLibrary(self.name)
 
-        # Build device list
+# threads that wait for the completion of asynchronous Kinesis moves, shared by all stages
+def _move_executor():
+    global _moveWaiters
+    if _moveWaiters is None:
+        _moveWaiters = ThreadPoolExecutor(thread_name_prefix='KinesisMove')
+    return _moveWaiters
+
+
+# Moves several Kinesis stages at the same time: every move is sent before waiting on any of them, and every stage
+# is waited for with its own moveTimeout. All failures are collected and raised together as one RuntimeError.
+def move_devices(moves):
+    futures = []
+    errors = []
+    for device, position in moves:
+        try:
+            futures.append((device, device.move_device_async(position)))
+        except Exception as error:
+            errors.append(f"{device.stageName}: {error}")
+    for device, future in futures:
+        try:
+            future.result()
+        except Exception as error:
+            errors.append(f"{device.stageName}: {error}")
+    if errors:
+        raise RuntimeError("Stage moves failed: " + "; ".join(errors))
+
+
+class KinesisSession:
+    """Shared Kinesis KCube DCServo library for the whole process.
+
+    The DLL is loaded and the device list is built once, stages are opened
+    in parallel and every opened stage is kept, so back-to-back Experiments
+    in the same process reuse the open sessions instead of opening (and
+    homing) the stages again. Use KinesisSession.get() to obtain it."""
+    _session = None
+    _lock = threading.Lock()
+    dllName = "Thorlabs.MotionControl.KCube.DCServo.dll"
+
+    def __init__(self, path_kinesis_install=r"C:\Program Files\Thorlabs\Kinesis", lib=None):
+        # lib replaces the DLL, e.g. simulation.SimulatedKinesisLib
+        if lib is None:
+            # the DLL finds its dependencies in the working directory, which is restored afterwards
+            workingDirectory = os.getcwd()
+            os.chdir(path_kinesis_install)
+            try:
+                lib = cdll.LoadLibrary(self.dllName)
+            finally:
+                os.chdir(workingDirectory)
+        self.lib = lib
         self.lib.TLI_BuildDeviceList()
+        self._devices = {}
+        self._homed = set()
+
+    @classmethod
+    def get(cls, path_kinesis_install=r"C:\Program Files\Thorlabs\Kinesis"):
+        with cls._lock:
+            if cls._session is None:
+                cls._session = cls(path_kinesis_install)
+            return cls._session
+
+    @staticmethod
+    def _key(serialNumber):
+        return serialNumber.value if hasattr(serialNumber, 'value') else serialNumber
+
+    def device(self, serialNumber, HomeStage=False, stageName=None, stageType='linear'):
+        """ Returns the open KinesisController of serialNumber, opening it if
+        needed. A stage is homed at most once per process. """
+        key = self._key(serialNumber)
+        with self._lock:
+            device = self._devices.get(key)
+        if device is None:
+            device = KinesisController(serialNumber=serialNumber, HomeStage=False, stageName=stageName, stageType=stageType, session=self)
+            with self._lock:
+                self._devices[key] = device
+        else:
+            device.stageName = stageName
+        if HomeStage and key not in self._homed:
+            print(f"Homing {stageName}")
+            device.home_device()
+            self._homed.add(key)
+        return device
+
+    def open_devices(self, stages):
+        """ Opens (or reuses) several stages at the same time, stages is a list
+        of dictionaries with the keyword arguments of device(). Returns the
+        controllers in the same order. """
+        with ThreadPoolExecutor(max_workers=max(1, len(stages)), thread_name_prefix='KinesisOpen') as executor:
+            return list(executor.map(lambda stage: self.device(**stage), stages))
+
+    def close(self):
+        with self._lock:
+            devices = list(self._devices.values())
+            self._devices = {}
+            self._homed = set()
+        for device in devices:
+            device.clean_up_device()
+
+
+class KinesisController:
+    def __init__(self, serialNumber=None, HomeStage=False, stageName=None, stageType='linear', path_kinesis_install=r"C:\Program Files\Thorlabs\Kinesis", session=None):
+
+        # the library is loaded and the device list is built once per process, see KinesisSession
+        if session is None:
+            session = KinesisSession.get(path_kinesis_install)
+        self.name = session.dllName
+        self.stageName = stageName
+        self.lib = session.lib
 
         self.serialNumber = serialNumber
         self.stepsPerRev = 512
@@ -1140,6 +1250,12 @@ class KinesisController:
             print('Stage type undefined')
 
         self.moveTimeout = 60.0
+        # longest wait for the first status update after the device has been opened
+        self.readyTimeout = 3.0
+        # longest sleep between two checks of the message queue while waiting for a move
+        self.pollInterval = 0.02
+        # (velocity, acceleration) before the first set_velocity, restored by restore_velocity
+        self.defaultVelocity = None
 
         # Setting up stage
         print(f"Initializing {self.stageName}")
@@ -1151,7 +1267,7 @@ class KinesisController:
 
         # Homing stages
         if HomeStage == True:
-            print(print(f"Homing {self.stageName}"))
+            print(f"Homing {self.stageName}")
             self.home_device()
 
 
@@ -1162,10 +1278,25 @@ class KinesisController:
         # might need to enable the channel:
         # lib.CC_EnableChannel(serialNumber)
 
-        time.sleep(3)
+        self.wait_until_ready()
         self.lib.CC_ClearMessageQueue(self.serialNumber)
 
 
+    # Returns as soon as polling reports the channel as enabled (status bit 0x80000000) instead of sleeping a fixed
+    # time; after readyTimeout it carries on like the old 3 s sleep did.
+    def wait_until_ready(self):
+        startTime = time.time()
+        delay = 0.005
+        while (time.time() - startTime) <= self.readyTimeout:
+            self.lib.CC_RequestStatusBits(self.serialNumber)
+            if self.lib.CC_GetStatusBits(self.serialNumber) & 0x80000000:
+                return True
+            time.sleep(delay)
+            delay = min(2 * delay, 0.1)
+        print(f"{self.stageName} did not report ready within {self.readyTimeout} s")
+        return False
+
+
     def clean_up_device(self):
         # clean up and exit
         self.lib.CC_ClearMessageQueue(self.serialNumber)
@@ -1175,21 +1306,36 @@ class KinesisController:
 
 
     def home_device(self):
+        self.lib.CC_ClearMessageQueue(self.serialNumber)
         homeStartTime = time.time()
         self.lib.CC_Home(self.serialNumber)
 
-        self.messageType = c_ushort()
-        self.messageID = c_ushort()
-        self.messageData = c_ulong()
-
-        homed = False
-        while (homed == False):
-            self.lib.CC_GetNextMessage(self.serialNumber, byref(self.messageType), byref(self.messageID), byref(self.messageData))
-            if ((self.messageID.value == 0 and self.messageType.value == 2) or (time.time() - homeStartTime) > self.moveTimeout):
-                homed = True
+        self.wait_for_message(2, 0, homeStartTime, 'homing')
         self.lib.CC_ClearMessageQueue(self.serialNumber)
 
 
+    # Waits for the generic motor message messageType/messageID (2/0 homed, 2/1 moved) without spinning: the queue
+    # is checked with a sleep that backs off from 1 ms to pollInterval while nothing arrives.
+    # onPoll is called on every check, e.g. to record the position during a fly move.
+    def wait_for_message(self, messageType, messageID, startTime, operation='moving', onPoll=None):
+        receivedType = c_ushort()
+        receivedID = c_ushort()
+        receivedData = c_ulong()
+        delay = 0.001
+        while (time.time() - startTime) <= self.moveTimeout:
+            if self.lib.CC_MessageQueueSize(self.serialNumber) > 0:
+                self.lib.CC_GetNextMessage(self.serialNumber, byref(receivedType), byref(receivedID), byref(receivedData))
+                if receivedType.value == messageType and receivedID.value == messageID:
+                    return
+                delay = 0.001
+                continue
+            if onPoll is not None:
+                onPoll()
+            time.sleep(delay)
+            delay = min(2 * delay, self.pollInterval)
+        raise TimeoutError(f"{self.stageName} did not finish {operation} within {self.moveTimeout} s")
+
+
     def set_up_device(self):
         # Set up to convert physical units to units on the device
         self.lib.CC_SetMotorParamsExt(self.serialNumber, c_double(self.stepsPerRev), c_double(self.gearBoxRatio), c_double(self.pitch))
@@ -1198,25 +1344,87 @@ class KinesisController:
         self.deviceUnit = deviceUnit
 
 
-    def move_device(self, position):
+    def start_move(self, position):
         deviceUnit = c_int()
 
         realUnit = c_double(position)
 
         self.lib.CC_GetDeviceUnitFromRealValue(self.serialNumber, realUnit, byref(deviceUnit), 0)
 
+        # a late message of an earlier move must not end the wait for this one
+        self.lib.CC_ClearMessageQueue(self.serialNumber)
         moveStartTime = time.time()
         self.lib.CC_MoveToPosition(self.serialNumber, deviceUnit)
+        return moveStartTime
+
+
+    def wait_for_move(self, moveStartTime, onPoll=None):
+        self.wait_for_message(2, 1, moveStartTime, 'moving', onPoll)
+
+
+    def move_device(self, position):
+        moveStartTime = self.start_move(position)
+        self.wait_for_move(moveStartTime)
+
+
+    # Sends the move right away and returns a concurrent.futures.Future that completes when the stage has arrived
+    # (or raises TimeoutError), so several stages can move at the same time.
+    def move_device_async(self, position):
+        moveStartTime = self.start_move(position)
+        return _move_executor().submit(self.wait_for_move, moveStartTime)
+
+
+    def get_position(self):
+        self.lib.CC_RequestPosition(self.serialNumber)
+        realUnit = c_double()
+        self.lib.CC_GetRealValueFromDeviceUnit(self.serialNumber, c_int(self.lib.CC_GetPosition(self.serialNumber)), byref(realUnit), 0)
+        return realUnit.value
+
+
+    # velocity in real units/s and acceleration in real units/s^2 (unit types 1 and 2 of the Kinesis conversions)
+    def get_velocity(self):
+        acceleration = c_int()
+        velocity = c_int()
+        self.lib.CC_GetVelParams(self.serialNumber, byref(acceleration), byref(velocity))
+
+        realVelocity = c_double()
+        realAcceleration = c_double()
+        self.lib.CC_GetRealValueFromDeviceUnit(self.serialNumber, velocity, byref(realVelocity), 1)
+        self.lib.CC_GetRealValueFromDeviceUnit(self.serialNumber, acceleration, byref(realAcceleration), 2)
+        return realVelocity.value, realAcceleration.value
+
+
+    def set_velocity(self, velocity, acceleration=None):
+        current = self.get_velocity()
+        if self.defaultVelocity is None:
+            self.defaultVelocity = current
+        if acceleration is None:
+            acceleration = current[1]
+
+        deviceVelocity = c_int()
+        deviceAcceleration = c_int()
+        self.lib.CC_GetDeviceUnitFromRealValue(self.serialNumber, c_double(velocity), byref(deviceVelocity), 1)
+        self.lib.CC_GetDeviceUnitFromRealValue(self.serialNumber, c_double(acceleration), byref(deviceAcceleration), 2)
+        self.lib.CC_SetVelParams(self.serialNumber, deviceAcceleration, deviceVelocity)
+
+
+    def restore_velocity(self):
+        if self.defaultVelocity is not None:
+            self.set_velocity(*self.defaultVelocity)
+
+
+    # moves at the current velocity and records (time.monotonic(), position) about every pollInterval seconds on the way
+    def fly_device(self, position, pollInterval=0.02):
+        trajectory = [(time.monotonic(), self.get_position())]
 
-        moved = False
-        messageType = c_ushort()
-        messageID = c_ushort()
-        messageData = c_ulong()
-        while (moved == False):
-            self.lib.CC_GetNextMessage(self.serialNumber, byref(messageType), byref(messageID), byref(messageData))
+        def record():
+            if time.monotonic() - trajectory[-1][0] >= pollInterval:
+                trajectory.append((time.monotonic(), self.get_position()))
 
-            if ((messageID.value == 1 and messageType.value == 2) or (time.time() - moveStartTime) > self.moveTimeout):
-                moved = True
+        moveStartTime = self.start_move(position)
+        self.wait_for_move(moveStartTime, record)
+        trajectory.append((time.monotonic(), self.get_position()))
+        return np.array(trajectory)
 
     def set_rel_efield(self, rel_efield):
         angle = np.arccos(np.sqrt(rel_efield)) * 180 / math.pi
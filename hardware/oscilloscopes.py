@@ -1,28 +1,141 @@
 import numpy as np
-import struct
 from . import connections
 import importlib
 import h5py
+import time
 from datetime import datetime
 importlib.reload(connections)
 
+# Integer kind and byte order of the binary curve encodings
+BINARY_ENCODINGS = {'RIB': ('i', '>'), 'RIBINARY': ('i', '>'),
+                    'RPB': ('u', '>'), 'RPBINARY': ('u', '>'),
+                    'SRI': ('i', '<'), 'SRIBINARY': ('i', '<'),
+                    'SRP': ('u', '<'), 'SRPBINARY': ('u', '<')}
+
+
+def parse_block(raw_data):
+    """ Returns the data of an IEEE 488.2 block, '#<n><length><data>'
+    for a definite length block or '#0<data>' for an indefinite one, as a
+    memoryview into raw_data (no copy). """
+    if raw_data[0:1] != b'#':
+        raise ValueError('Curve data is not an IEEE 488.2 block')
+    num_digits = int(raw_data[1:2])
+    if num_digits == 0:
+        # Indefinite length, the data runs up to the terminating newline
+        return memoryview(raw_data)[2:len(raw_data.rstrip(b'\n'))]
+    start = 2 + num_digits
+    length = int(raw_data[2:start])
+    if len(raw_data) < start + length:
+        raise ValueError('Curve data block is incomplete: expected %i bytes, '
+                         'got %i' % (length, len(raw_data) - start))
+    return memoryview(raw_data)[start:start + length]
+
+
+def decode_curve(raw_data, encoding='RPB', num_bytes=1):
+    """ Decodes a CURVE? reply into an array of digitizer codes. Binary
+    encodings (RIB, RPB, SRI, SRP) with 1 or 2 bytes per point are read
+    with np.frombuffer directly from the reply, ASCII with np.array. """
+    encoding = encoding.upper()
+    if encoding in ('ASCI', 'ASCII'):
+        return np.array(raw_data.decode('utf-8').strip().split(','),
+                        dtype=np.int32)
+    if encoding not in BINARY_ENCODINGS or num_bytes not in (1, 2):
+        raise NotImplementedError('Encoding %s with %i bytes per point'
+                                  % (encoding, num_bytes))
+    kind, byte_order = BINARY_ENCODINGS[encoding]
+    dtype = np.dtype('%s%s%i' % (byte_order, kind, num_bytes))
+    block = parse_block(raw_data)
+    if len(block) % num_bytes:
+        raise ValueError('Curve data length %i is not a multiple of %i bytes'
+                         % (len(block), num_bytes))
+    return np.frombuffer(block, dtype=dtype)
+
+
+def stack_waveforms(waveforms, channels):
+    """ Combines Waveforms of different channels of the same acquisition
+    into one Waveform with codes stacked as (channel x point). """
+    preamble = {'XINC': waveforms[0].preamble['XINC'],
+                'XZE': waveforms[0].preamble['XZE']}
+    for key in ('YMU', 'YOF', 'YZE'):
+        preamble[key] = np.array([waveform.preamble[key]
+                                  for waveform in waveforms])
+    return Waveform(np.stack([waveform.codes for waveform in waveforms]),
+                    preamble, [str(channel) for channel in channels])
+
+
+class Waveform():
+    """ Curve data of one acquisition as transferred from the scope
+    (digitizer codes) together with the waveform preamble needed to scale
+    it. Unpacks and indexes like the (time_base, ydata) tuple returned by
+    get_data, but the scaled arrays are only computed when accessed.
+    For several channels codes is stacked as (channel x point) and the
+    Y preamble values are arrays with one value per channel. """
+
+    def __init__(self, codes, preamble, channels=None):
+        self.codes = codes
+        # Keys: 'YMU', 'YOF', 'YZE', 'XINC', 'XZE'
+        self.preamble = preamble
+        self.channels = channels
+
+    def _y_scale(self, key):
+        if self.codes.ndim > 1:
+            # One value per channel, broadcast along the points
+            return np.reshape(self.preamble[key], (-1, 1))
+        return self.preamble[key]
+
+    @property
+    def time_base(self):
+        return self.preamble['XZE'] + \
+            self.preamble['XINC'] * np.arange(0, self.codes.shape[-1])
+
+    @property
+    def ydata(self):
+        return self._y_scale('YZE') + \
+            ((self.codes - self._y_scale('YOF')) * self._y_scale('YMU'))
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        if index in (0, -2):
+            return self.time_base
+        if index in (1, -1):
+            return self.ydata
+        raise IndexError('Waveform index out of range')
+
+    def __iter__(self):
+        yield self.time_base
+        yield self.ydata
+
+    def __repr__(self):
+        return repr(tuple(self))
+
 
 class Oscilloscopes(connections.VISAConnection):
 
-    def __init__(self, instrument_ip_address):
+    def __init__(self, instrument_ip_address, resource_manager=None):
         self.instrument_ip_address = instrument_ip_address
         self.resource_name = "TCPIP0::%s::INSTR" % self.instrument_ip_address
-        super().__init__(self.resource_name)
+        super().__init__(self.resource_name, resource_manager)
 
 
 class Tektronix_DPO4102B(Oscilloscopes):
 
-    def __init__(self, instrument_ip_address='192.168.1.4'):
-        super().__init__(instrument_ip_address)
+    def __init__(self, instrument_ip_address='192.168.1.4',
+                 resource_manager=None):
+        super().__init__(instrument_ip_address, resource_manager)
+        # Waveform preambles keyed by the transfer settings they belong to.
+        # Set cache_preamble to False if the scale is changed on the front
+        # panel during a measurement.
+        self.cache_preamble = True
+        self._preambles = {}
+        # Transfer settings last sent to the scope, see arm_transfer
+        self._transfer_config = {}
 
     def set_byte_number(self, num_bytes=2, silent=True):
         cmd = 'WFMO:BYT_Nr %i' % num_bytes
         self.send(cmd)
+        self._transfer_config['num_bytes'] = num_bytes
         if not silent:
             self.query_byte_number()
 
@@ -33,22 +146,27 @@ class Tektronix_DPO4102B(Oscilloscopes):
     def set_data_encoding(self, encoding, silent=False):
         cmd = 'DATA:ENC %s' % encoding
         self.send(cmd)
+        self._transfer_config['encoding'] = encoding
         if not silent:
             self.query_data_encoding()
 
     def set_data_source(self, channel, silent=False):
         cmd = 'DAT:SOU CH%s' % channel
         self.send(cmd)
+        self._transfer_config['channel'] = str(channel)
         if not silent:
             self.query_data_source()
 
     def set_data_start(self, start, silent=False):
         cmd = 'DAT:STAR %s' % start
         self.send(cmd)
+        self._transfer_config['start'] = start
         if not silent:
             self.query_data_start()
 
     def set_data_stop(self, stop, silent=False):
+        # Remember the requested value, so -1 is not resolved again
+        self._transfer_config['stop'] = stop
         if stop == -1:
             # Take full wave-form data
             stop = self.get_horizontal_record_length()
@@ -64,12 +182,14 @@ class Tektronix_DPO4102B(Oscilloscopes):
 
     def set_header(self, status=1, silent=True):
         self.connection.write('HEAD %s' % status)
+        self._transfer_config['header'] = status
         if not silent:
             self.query_header()
 
     def set_acquisition_mode(self, mode, silent=True):
         """ Possible modes: SAM | PEAK | HIR | AVE | ENV """
         self.connection.write('ACQ:MOD %s' % mode)
+        self.invalidate_preamble()
         if not silent:
             self.query_acquisition_mode()
 
@@ -131,6 +251,43 @@ class Tektronix_DPO4102B(Oscilloscopes):
                 print('No')
         return reply
 
+    def get_acquisition_count(self):
+        """ Number of acquisitions since the last ACQ:STATE RUN. """
+        return int(self.transaction('ACQ:NUMAC?'))
+
+    def wait_operation_complete(self, timeout=10):
+        """ Blocks on *OPC? until pending operations (e.g. a STOP or a
+        single sequence) are complete. Returns False if the scope did not
+        answer within timeout seconds. """
+        old_timeout = self.connection.timeout
+        self.connection.timeout = timeout * 1000  # VISA timeout is in ms
+        try:
+            return self.transaction('*OPC?') == '1'
+        except Exception:
+            return False
+        finally:
+            self.connection.timeout = old_timeout
+
+    def get_settle_acquisitions(self):
+        """ Number of new acquisitions after which the displayed trace only
+        holds records taken after the call: ACQ:NUMAV when averaging,
+        otherwise 1. """
+        if self.transaction('ACQ:MOD?').split()[-1].upper().startswith('AVE'):
+            return int(self.transaction('ACQ:NUMAV?').split()[-1])
+        return 1
+
+    def wait_for_acquisitions(self, count=1, timeout=10, poll_interval=0.01):
+        """ Polls ACQ:NUMAC? until count new acquisitions have completed
+        since the call, i.e. until there is a trace recorded after
+        everything that happened before. Returns False on timeout. """
+        end_time = time.time() + timeout
+        target = self.get_acquisition_count() + count
+        while self.get_acquisition_count() < target:
+            if time.time() > end_time:
+                return False
+            time.sleep(poll_interval)
+        return True
+
     def get_horizontal_record_length(self):
         return int(self.transaction('HOR:RECO?'))
 
@@ -159,6 +316,58 @@ class Tektronix_DPO4102B(Oscilloscopes):
     def get_y_axis_unit(self, silent=False):
         return self.transaction('WFMO:YUN?').strip('""')
 
+    def arm_transfer(self,
+                     channel='2',
+                     encoding='RPB',
+                     start=1,
+                     stop=-1,
+                     num_bytes=1,
+                     silent=True):
+        """ Applies the settings used by CURVE? (header off, encoding,
+        source, start, stop, bytes per point), only sending the ones that
+        differ from what was last sent. Returns the settings as a tuple. """
+        config = self._transfer_config
+        if config.get('header') != 0:
+            self.set_header(status=0)  # Turn off the header
+        if config.get('encoding') != encoding:
+            self.set_data_encoding(encoding, silent=silent)
+        if config.get('channel') != str(channel):
+            self.set_data_source(channel, silent=silent)
+        if config.get('start') != start:
+            self.set_data_start(start, silent=silent)
+        if config.get('stop') != stop:
+            self.set_data_stop(stop, silent=silent)
+        if config.get('num_bytes') != num_bytes:
+            self.set_byte_number(num_bytes, silent=True)
+        return (str(channel), encoding.upper(), start, stop, num_bytes)
+
+    def reset_transfer_config(self):
+        """ Forget the applied transfer settings so the next arm_transfer
+        sends all of them again, e.g. after the record length was changed
+        on the front panel. """
+        self._transfer_config = {}
+
+    def invalidate_preamble(self):
+        """ Forget all cached waveform preambles. """
+        self._preambles = {}
+
+    def query_preamble(self):
+        """ Returns the scaling of the outgoing waveform as a dict with
+        keys 'YMU', 'YOF', 'YZE', 'XINC' and 'XZE', using one
+        concatenated query instead of one transaction per value. The
+        header must be off (see set_header). """
+        reply = self.transaction('WFMO:YMU?;YOF?;YZE?;XIN?;XZE?')
+        keys = ['YMU', 'YOF', 'YZE', 'XINC', 'XZE']
+        return dict(zip(keys, [float(value) for value in reply.split(';')]))
+
+    def get_preamble(self, transfer_settings):
+        """ Returns the preamble for the given transfer settings, only
+        querying the scope when it is not cached. """
+        if not self.cache_preamble or \
+                transfer_settings not in self._preambles:
+            self._preambles[transfer_settings] = self.query_preamble()
+        return self._preambles[transfer_settings]
+
     def get_data(self,
                  channel='2',
                  encoding='RPB',
@@ -170,45 +379,113 @@ class Tektronix_DPO4102B(Oscilloscopes):
         (e.g. in units of [s] and [V]) over a specified range
         (defaults to full waveform) from specified channel
         (default to 1).
-        WARNING! This method will currently not be robust to changes in
-        the encoding due to byte ordering swaps. """
-        self.set_header(status=0)  # Turn off the header
-        # If encoding is set to 'binary', rather than 'ascii', take care of
-        # additional header of the form '#head_length,data_length'.
-        self.set_data_encoding(encoding, silent=silent)
-        self.set_data_source(channel, silent=silent)
-        self.set_data_start(start, silent=silent)
-        self.set_data_stop(stop, silent=silent)
-        self.set_byte_number(num_bytes, silent=True)
+        Supported encodings are RIB, RPB, SRI and SRP with 1 or 2 bytes
+        per point, and ASCII. """
+        return tuple(self.get_waveform(channel, encoding, start, stop,
+                                       silent, num_bytes))
+
+    def get_waveform(self,
+                     channel='2',
+                     encoding='RPB',
+                     start=1,
+                     stop=-1,
+                     silent=True,
+                     num_bytes=1):
+        """ Same transfer as get_data, but returns a Waveform holding the
+        unscaled digitizer codes and the preamble used to scale them. """
+        transfer_settings = self.arm_transfer(channel, encoding, start, stop,
+                                              num_bytes, silent)
+        self.send('CURVE?')
+        self.raw_data = self.connection.read_raw()
+        # Binary data comes as '#<n><length><data>\n', the codes are a
+        # read-only view into raw_data
+        self.decoded_data = decode_curve(self.raw_data, encoding, num_bytes)
+        preamble = self.get_preamble(transfer_settings)
+        return Waveform(self.decoded_data, preamble)
+
+    def get_multi_waveform(self,
+                           channels=('1', '2'),
+                           encoding='RPB',
+                           start=1,
+                           stop=-1,
+                           silent=True,
+                           num_bytes=1):
+        """ Reads several channels of the same acquisition and returns them
+        as one Waveform with codes stacked as (channel x point). The
+        DPO4000 series transfers one source per CURVE?, so the channels
+        are read one after another; stop the acquisition first (ACQ:STATE
+        STOP) so that all of them come from the same trigger. With the
+        transfer settings and preambles cached only DAT:SOU and CURVE? are
+        sent per channel. """
+        waveforms = [self.get_waveform(channel, encoding, start, stop,
+                                       silent, num_bytes)
+                     for channel in channels]
+        return stack_waveforms(waveforms, channels)
+
+    def set_fastframe(self, count):
+        """ Enables FastFrame (segmented memory) acquisition of count frames.
+        Only available on scopes with the HORizontal:FASTframe commands,
+        e.g. the MSO/DPO5000 series; the DPO4000 series does not have
+        FastFrame. """
+        self.connection.write('HOR:FAST:STATE ON')
+        self.connection.write('HOR:FAST:COUN %i' % count)
+        self.invalidate_preamble()
+
+    def disable_fastframe(self):
+        self.connection.write('HOR:FAST:STATE OFF')
+        self.invalidate_preamble()
+
+    def force_trigger(self):
+        """ Forces a trigger event, in FastFrame mode this records the next
+        frame. """
+        self.connection.write('TRIG FORC')
+
+    def trigger_frames(self, count, interval):
+        """ Forces count triggers interval seconds apart, e.g. while the
+        stage flies over a line, and returns the time.monotonic() time stamp
+        of every trigger so the frames can be matched to stage positions. """
+        times = np.empty(count)
+        start = time.monotonic()
+        for i in range(count):
+            delay = start + i*interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.force_trigger()
+            times[i] = time.monotonic()
+        return times
+
+    def start_frames(self, count):
+        """ Arms a single sequence that records count FastFrame frames, one
+        per trigger. """
+        self.set_fastframe(count)
+        self.set_acquire_sequence()
+        self.set_acquisition_state('RUN')
+
+    def get_frames(self,
+                   channel='2',
+                   count=1,
+                   encoding='RPB',
+                   start=1,
+                   stop=-1,
+                   silent=True,
+                   num_bytes=1):
+        """ Waits for the FastFrame sequence started with start_frames to
+        complete and transfers frames 1 to count with one CURVE?. Returns
+        one Waveform per frame; their codes are views into the same
+        buffer. """
+        self.transaction('*OPC?')  # Returns when the sequence is complete
+        transfer_settings = self.arm_transfer(channel, encoding, start, stop,
+                                              num_bytes, silent)
+        if self._transfer_config.get('frames') != count:
+            self.send('DAT:FRAMESTAR 1')
+            self.send('DAT:FRAMESTOP %i' % count)
+            self._transfer_config['frames'] = count
         self.send('CURVE?')
         self.raw_data = self.connection.read_raw()
-        # Remove the additional header for Binary data - TODO! Implement check
-        # for ASCII format
-        if self.transaction('DAT:ENC?') == 'RPBINARY' or 'RPB':
-            # This is because the second element of binary data is num bits of
-            # data length, e.g. 3 for data of length 100 points
-            bin_header_length = 2 + int(self.raw_data[1:2].decode('utf-8'))
-            self.header = self.raw_data[:bin_header_length]
-            self.raw_data_no_header = self.raw_data[bin_header_length:-1]
-            # TODO! Implement how to read as 2 bytes per data point, i.e. total
-            # of 32 bits for higher precision
-            self.decoded_data = np.array(struct.unpack('%sB' % len(
-                self.raw_data_no_header), self.raw_data_no_header), )
-        else:
-            raise NotImplemented
-        y_offset = self.get_y_axis_offset()
-        y_multiplier = self.get_y_axis_multiplier()
-        y_zero = self.get_y_axis_zero()
-
-        ydata_in_units = y_zero + \
-            ((self.decoded_data - y_offset) * y_multiplier)
-
-        x_increment = self.get_x_axis_increment(silent=silent)
-        num_points = len(ydata_in_units)
-        x_zero = self.get_x_axis_zero()
-        time_base = x_zero + x_increment * np.arange(0,num_points)
-
-        return time_base, ydata_in_units
+        self.decoded_data = decode_curve(self.raw_data, encoding, num_bytes)
+        preamble = self.get_preamble(transfer_settings + ('frames', count))
+        return [Waveform(codes, preamble)
+                for codes in self.decoded_data.reshape(count, -1)]
 
     def create_h5_archive(self, data):
         """ TODO! FIX """
@@ -248,8 +525,9 @@ class Tektronix_DPO4102B(Oscilloscopes):
 
 class Tektronix_MDO4104C(Tektronix_DPO4102B):
 
-    def __init__(self, instrument_ip_address='192.168.1.5'):
-        super().__init__(instrument_ip_address)
+    def __init__(self, instrument_ip_address='192.168.1.5',
+                 resource_manager=None):
+        super().__init__(instrument_ip_address, resource_manager)
 
 
 if __name__ == "__main__":
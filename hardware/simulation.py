@@ -0,0 +1,769 @@
+"""Simulated instruments for running experiments without hardware.
+
+The stand-ins answer the commands the drivers send, so the real driver
+classes run unchanged on top of them:
+
+    SimulatedScope          VISA resource of oscilloscopes.Tektronix_DPO4102B
+    SimulatedKinesisLib     Kinesis KCube DCServo DLL of motion_controllers.KinesisController
+    SimulatedESP300         serial connection of motion_controllers.ESP300_Control
+    SimulatedPI_E873        serial connection of motion_controllers.PI_E873_3QTU
+
+All of them belong to a SimulatedBench, which holds the settings (command
+latency, transfer bandwidth, record length, stage velocity) and the
+synthetic beam the scope sees at the current stage positions. Enable it
+with simulate = True in config.py.
+
+"""
+import re
+import threading
+import time
+import numpy as np
+
+
+class SimulatedBench:
+    """ Settings and shared state of the simulated instruments.
+
+    latency is the round trip time of one command in seconds (half of it
+    is spent sending, half reading the reply), bandwidth the transfer rate
+    of replies in bytes/s. The beam is a gaussian beam with its waist at
+    center (X, Y, Z), waist radius waist and rayleighRange in stage units,
+    its peak signal is amplitude volts with gaussian noise of noise volts.
+    Stages report their position through add_axis. """
+    defaults = {'latency': 0.002,
+                'bandwidth': 10e6,
+                'recordLength': 10000,
+                'sampleInterval': 4e-10,
+                'acquisitionRate': 50,
+                'verticalRange': 1.0,
+                'stageVelocity': 2.0,
+                'seed': None,
+                'beam': {'center': [9, 13.5, 0],
+                         'waist': 0.5,
+                         'rayleighRange': 10,
+                         'amplitude': 0.4,
+                         'noise': 0.002,
+                         'pulseWidth': 100}}
+
+    def __init__(self, settings=None):
+        settings = dict(settings or {})
+        beam = dict(self.defaults['beam'])
+        beam.update(settings.pop('beam', None) or {})
+        self.settings = dict(self.defaults)
+        self.settings.update(settings)
+        self.settings['beam'] = beam
+        self._axes = {}
+        self._rng = np.random.default_rng(self.settings['seed'])
+        self._lock = threading.Lock()
+        self._kinesis_lib = None
+        self._shape = None
+        self._noise = None
+        # waveform (CURVE?) transfers of every simulated scope, seconds is
+        # the transfer time and generateSeconds the time spent simulating
+        # the traces
+        self.transfers = {'count': 0, 'bytes': 0, 'seconds': 0.0,
+                          'generateSeconds': 0.0}
+
+    def delay(self, fraction=1.0, num_bytes=0):
+        """ Sleeps for fraction of the command latency plus the time needed
+        to transfer num_bytes. """
+        seconds = fraction * self.settings['latency'] + \
+            num_bytes / self.settings['bandwidth']
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def record_transfer(self, num_bytes, seconds):
+        with self._lock:
+            self.transfers['count'] += 1
+            self.transfers['bytes'] += num_bytes
+            self.transfers['seconds'] += seconds
+
+    def record_generation(self, seconds):
+        with self._lock:
+            self.transfers['generateSeconds'] += seconds
+
+    def add_axis(self, axis, position):
+        """ Registers position, a function returning the current position,
+        as the stage of axis ('X', 'Y' or 'Z' move the beam). """
+        self._axes[axis] = position
+
+    def positions(self):
+        return {axis: position() for axis, position in self._axes.items()}
+
+    def beam_signal(self, positions):
+        """ Peak signal in volts of the beam at the stage positions, axes
+        without a stage sit at the center of the beam. """
+        beam = self.settings['beam']
+        center = beam['center']
+        x, y, z = [positions.get(axis, center[i])
+                   for i, axis in enumerate(['X', 'Y', 'Z'])]
+        radius = beam['waist'] * \
+            np.sqrt(1 + ((z - center[2]) / beam['rayleighRange'])**2)
+        return beam['amplitude'] * (beam['waist'] / radius)**2 * \
+            np.exp(-2 * ((x - center[0])**2 + (y - center[1])**2) / radius**2)
+
+    def trace(self, channel, positions, num_points):
+        """ One record in volts: a gaussian pulse in the middle of the
+        record plus noise. Channel 1 is the reference (the full beam),
+        every other channel the beam at the stage positions. """
+        beam = self.settings['beam']
+        if str(channel) == '1':
+            signal = beam['amplitude']
+        else:
+            signal = self.beam_signal(positions)
+        with self._lock:
+            if self._shape is None or len(self._shape) != num_points:
+                samples = np.arange(num_points) - num_points / 2
+                self._shape = np.exp(-0.5 * (samples / beam['pulseWidth'])**2
+                                     ).astype('f4')
+                # noise of the traces is a random slice of this, so long
+                # records do not spend their time in the random generator
+                self._noise = self._rng.normal(
+                    0, beam['noise'], num_points + 4096).astype('f4')
+            offset = self._rng.integers(4096)
+            shape = self._shape
+            noise = self._noise[offset:offset + num_points]
+        return signal * shape + noise
+
+    def resource_manager(self):
+        return SimulatedResourceManager(self)
+
+    def kinesis_lib(self):
+        """ The simulated Kinesis library, shared by every KinesisSession of
+        this bench. """
+        with self._lock:
+            if self._kinesis_lib is None:
+                self._kinesis_lib = SimulatedKinesisLib(self)
+            return self._kinesis_lib
+
+
+_bench = None
+
+
+def configure(settings=None):
+    """ Replaces the bench used by the simulated connections and returns
+    it. """
+    global _bench
+    _bench = SimulatedBench(settings)
+    return _bench
+
+
+def get_bench():
+    if _bench is None:
+        return configure()
+    return _bench
+
+
+class SimulatedAxis:
+    """ A stage axis that moves at a constant velocity. A move starts after
+    the command latency and the position is interpolated in time, so it can
+    be polled like a real stage. """
+
+    def __init__(self, bench, position=0.0):
+        self.bench = bench
+        self.velocity = bench.settings['stageVelocity']
+        now = time.monotonic()
+        # (start position, target, start time, end time), replaced at once
+        self._move = (position, position, now, now)
+
+    def position(self, now=None):
+        start, target, start_time, end_time = self._move
+        if now is None:
+            now = time.monotonic()
+        if now >= end_time:
+            return target
+        if now <= start_time:
+            return start
+        return start + (target - start) * (now - start_time) / \
+            (end_time - start_time)
+
+    def target(self):
+        return self._move[1]
+
+    def move(self, target):
+        """ Starts a move to target and returns the time.monotonic() at
+        which it is done. """
+        now = time.monotonic()
+        start = self.position(now)
+        start_time = now + self.bench.settings['latency']
+        end_time = start_time + abs(target - start) / max(self.velocity, 1e-12)
+        self._move = (start, target, start_time, end_time)
+        return end_time
+
+    def stop(self):
+        position = self.position()
+        now = time.monotonic()
+        self._move = (position, position, now, now)
+
+    def set_position(self, position):
+        """ Redefines the current position without moving. """
+        self.stop()
+        now = time.monotonic()
+        self._move = (position, position, now, now)
+
+    def is_moving(self):
+        return time.monotonic() < self._move[3]
+
+
+class SimulatedResourceManager:
+    """ Stand-in for visa.ResourceManager, every resource is a
+    SimulatedScope. """
+
+    def __init__(self, bench):
+        self.bench = bench
+
+    def open_resource(self, resource_name):
+        return SimulatedScope(self.bench, resource_name)
+
+
+class SimulatedScope:
+    """ Stand-in for the VISA resource of a Tektronix DPO4000 series scope.
+
+    Understands the commands used by oscilloscopes.Tektronix_DPO4102B:
+    settings are stored and read back, CURVE? returns a binary (RIB, RPB,
+    SRI, SRP) or ASCII block of the selected range of the record and the
+    WFMO queries return the matching preamble. While running the scope
+    acquires acquisitionRate traces per second; a stopped scope keeps the
+    stage positions of its last acquisition. With FastFrame on every
+    TRIG FORC records the stage positions of one frame. """
+    _signed = {'RIB': True, 'RIBINARY': True, 'SRI': True, 'SRIBINARY': True,
+               'RPB': False, 'RPBINARY': False, 'SRP': False, 'SRPBINARY': False}
+    _little_endian = ('SRI', 'SRIBINARY', 'SRP', 'SRPBINARY')
+
+    def __init__(self, bench, resource_name):
+        self.bench = bench
+        self.resource_name = resource_name
+        # VISA timeout in ms, only stored
+        self.timeout = 2000
+        record_length = bench.settings['recordLength']
+        self._settings = {'DAT:ENC': 'RPB', 'DAT:SOU': 'CH1', 'DAT:STAR': '1',
+                          'DAT:STOP': str(record_length), 'WFMO:BYT_NR': '1',
+                          'HEAD': '1', 'VERBOSE': '1', 'ACQ:MOD': 'SAMPLE',
+                          'ACQ:NUMAV': '16', 'ACQ:STOPA': 'RUNSTOP',
+                          'HOR:FAST:STATE': '0', 'HOR:FAST:COUN': '1',
+                          'DAT:FRAMESTAR': '1', 'DAT:FRAMESTOP': '1'}
+        self._record_length = record_length
+        self._lock = threading.Lock()
+        self._reply = b''
+        self._curve_reply = False
+        self._running = True
+        self._run_start = time.monotonic()
+        self._count = 0
+        self._positions = {}
+        self._frames = []
+
+    # --- VISA resource interface --- #
+
+    def write(self, command):
+        self.bench.delay(0.5)
+        with self._lock:
+            replies = []
+            prefix = ''
+            for part in command.strip().split(';'):
+                part = part.strip()
+                if not part:
+                    continue
+                header, _, argument = part.partition(' ')
+                header = self._normalize(header)
+                if ':' not in header and not header.startswith('*') and prefix:
+                    header = prefix + header
+                elif ':' in header:
+                    prefix = header.rsplit(':', 1)[0] + ':'
+                if header.endswith('?'):
+                    replies.append(self._query(header[:-1]))
+                else:
+                    self._set(header, argument.strip())
+            if replies:
+                self._curve_reply = isinstance(replies[0], bytes)
+                if self._curve_reply:
+                    self._reply = replies[0]
+                else:
+                    self._reply = (';'.join(replies) + '\n').encode()
+
+    def read_raw(self):
+        with self._lock:
+            reply = self._reply
+            curve = self._curve_reply
+            self._reply = b''
+        start = time.perf_counter()
+        self.bench.delay(0.5, len(reply))
+        if curve:
+            self.bench.record_transfer(len(reply), time.perf_counter() - start)
+        if not reply:
+            raise TimeoutError('%s: nothing to read' % self.resource_name)
+        return reply
+
+    def query(self, command):
+        self.write(command)
+        return self.read_raw().decode().rstrip()
+
+    def close(self):
+        pass
+
+    # --- Command handling --- #
+
+    @staticmethod
+    def _normalize(header):
+        header = header.upper()
+        if header.startswith('DATA:'):
+            header = 'DAT:' + header[5:]
+        return header
+
+    def _acquisitions(self, now):
+        """ Acquisitions since the last ACQ:STATE RUN, a single sequence
+        stops after its first acquisition. """
+        if not self._running:
+            return self._count
+        count = self._acquisitions_until(now)
+        if count > self._count and not self._fastframe() and \
+                self._settings['ACQ:STOPA'].startswith('SEQ'):
+            self._positions = self.bench.positions()
+            self._running = False
+            self._count += 1
+            return self._count
+        return count
+
+    def _stop(self, now):
+        if self._running:
+            self._count = self._acquisitions_until(now)
+            self._positions = self.bench.positions()
+            self._running = False
+
+    def _acquisitions_until(self, now):
+        if self._fastframe():
+            return self._count + len(self._frames)
+        return self._count + int((now - self._run_start) *
+                                 self.bench.settings['acquisitionRate'])
+
+    def _fastframe(self):
+        return self._settings['HOR:FAST:STATE'] in ('1', 'ON')
+
+    def _set(self, header, argument):
+        if header == 'ACQ:STATE':
+            now = time.monotonic()
+            if argument.upper() in ('RUN', 'ON', '1'):
+                if not self._running:
+                    self._running = True
+                    self._run_start = now
+                    self._count = 0
+                self._frames = []
+            else:
+                self._stop(now)
+        elif header == 'TRIG':
+            if self._running and self._fastframe():
+                self._frames.append(self.bench.positions())
+                if len(self._frames) >= int(self._settings['HOR:FAST:COUN']) \
+                        and self._settings['ACQ:STOPA'].startswith('SEQ'):
+                    self._stop(time.monotonic())
+        elif header == 'HOR:RECO':
+            self._record_length = int(argument)
+        else:
+            self._settings[header] = argument.upper()
+
+    def _query(self, header):
+        if header == '*IDN':
+            return 'TEKTRONIX,DPO4102B,SIMULATED,CF:91.1CT FV:v2.18'
+        if header == '*OPC':
+            return '1'
+        if header == 'BUSY':
+            return '0'
+        if header == 'ACQ:NUMAC':
+            return str(self._acquisitions(time.monotonic()))
+        if header == 'ACQ':
+            return '%s;%s;%i;%s' % (self._settings['ACQ:MOD'],
+                                   self._settings['ACQ:NUMAV'],
+                                   int(self._running),
+                                   self._settings['ACQ:STOPA'])
+        if header == 'HOR:RECO':
+            return str(self._record_length)
+        if header == 'CURVE':
+            return self._curve()
+        if header.startswith('WFMO:') and header != 'WFMO:BYT_NR':
+            return self._preamble(header[5:])
+        return self._settings.get(header, '0')
+
+    def _format(self):
+        encoding = self._settings['DAT:ENC']
+        num_bytes = int(self._settings['WFMO:BYT_NR'])
+        return encoding, num_bytes
+
+    def _preamble(self, key):
+        encoding, num_bytes = self._format()
+        levels = 2**(8 * num_bytes)
+        signed = self._signed.get(encoding, True)
+        values = {'YMU': self.bench.settings['verticalRange'] / levels,
+                  'YOF': 0 if signed else levels // 2,
+                  'YZE': 0.0,
+                  'XIN': self.bench.settings['sampleInterval'],
+                  'XINC': self.bench.settings['sampleInterval'],
+                  'XZE': -self.bench.settings['sampleInterval'] *
+                  self._record_length / 2,
+                  'XUN': '"s"',
+                  'YUN': '"V"'}
+        return str(values.get(key, '0'))
+
+    def _codes(self, volts):
+        encoding, num_bytes = self._format()
+        levels = 2**(8 * num_bytes)
+        signed = self._signed.get(encoding, True)
+        offset = 0 if signed else levels // 2
+        low = -levels // 2 + offset
+        codes = np.clip(np.round(volts * levels /
+                                 self.bench.settings['verticalRange']) + offset,
+                        low, low + levels - 1)
+        return codes.astype(np.int64)
+
+    def _curve(self):
+        generate_start = time.perf_counter()
+        channel = self._settings['DAT:SOU'].replace('CH', '')
+        start = max(int(self._settings['DAT:STAR']), 1)
+        stop = min(int(self._settings['DAT:STOP']), self._record_length)
+        if self._fastframe():
+            first = int(self._settings['DAT:FRAMESTAR'])
+            last = int(self._settings['DAT:FRAMESTOP'])
+            frames = self._frames or [self.bench.positions()]
+            snapshots = [frames[min(i, len(frames)) - 1]
+                         for i in range(first, last + 1)]
+        elif self._running:
+            snapshots = [self.bench.positions()]
+        else:
+            snapshots = [self._positions]
+        codes = np.concatenate(
+            [self._codes(self.bench.trace(channel, positions,
+                                          self._record_length))[start - 1:stop]
+             for positions in snapshots])
+        encoding, num_bytes = self._format()
+        if encoding in ('ASCI', 'ASCII'):
+            reply = (','.join(str(code) for code in codes) + '\n').encode()
+            self.bench.record_generation(time.perf_counter() - generate_start)
+            return reply
+        byte_order = '<' if encoding in self._little_endian else '>'
+        kind = 'i' if self._signed.get(encoding, True) else 'u'
+        data = codes.astype('%s%s%i' % (byte_order, kind, num_bytes)).tobytes()
+        length = str(len(data))
+        reply = b'#' + str(len(length)).encode() + length.encode() + data + b'\n'
+        self.bench.record_generation(time.perf_counter() - generate_start)
+        return reply
+
+
+class _KinesisDevice:
+
+    def __init__(self, bench):
+        self.axis = SimulatedAxis(bench)
+        # device units per real unit, see CC_SetMotorParamsExt
+        self.scale = 512 * 67
+        self.acceleration = 4.0
+        self.open = False
+        self.messages = []
+        # (time, message type, message id) posted once the time has passed
+        self.pending = None
+
+
+class SimulatedKinesisLib:
+    """ Stand-in for the Thorlabs.MotionControl.KCube.DCServo DLL with the
+    functions used by motion_controllers.KinesisController. Arguments are
+    the same ctypes values and byref() references as for the DLL. A move
+    or homing puts the generic motor message (2, 1) or (2, 0) in the
+    message queue once the simulated stage has arrived. """
+
+    def __init__(self, bench):
+        self.bench = bench
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _value(argument):
+        return argument.value if hasattr(argument, 'value') else argument
+
+    @staticmethod
+    def _store(reference, value):
+        getattr(reference, '_obj', reference).value = value
+
+    def _device(self, serial_number):
+        key = self._value(serial_number)
+        with self._lock:
+            if key not in self._devices:
+                self._devices[key] = _KinesisDevice(self.bench)
+            return self._devices[key]
+
+    def _post_messages(self, device):
+        if device.pending is not None and time.monotonic() >= device.pending[0]:
+            device.messages.append(device.pending[1:])
+            device.pending = None
+
+    def TLI_BuildDeviceList(self):
+        return 0
+
+    def CC_Open(self, serial_number):
+        self._device(serial_number).open = True
+        return 0
+
+    def CC_Close(self, serial_number):
+        self._device(serial_number).open = False
+
+    def CC_StartPolling(self, serial_number, milliseconds):
+        return True
+
+    def CC_StopPolling(self, serial_number):
+        pass
+
+    def CC_EnableChannel(self, serial_number):
+        return 0
+
+    def CC_RequestStatusBits(self, serial_number):
+        return 0
+
+    def CC_GetStatusBits(self, serial_number):
+        # bit 0x80000000: channel enabled
+        return 0x80000000 if self._device(serial_number).open else 0
+
+    def CC_SetMotorParamsExt(self, serial_number, steps_per_rev, gear_box_ratio, pitch):
+        self._device(serial_number).scale = self._value(steps_per_rev) * \
+            self._value(gear_box_ratio) / self._value(pitch)
+        return 0
+
+    def CC_GetDeviceUnitFromRealValue(self, serial_number, real_value, device_unit, unit_type):
+        scale = self._device(serial_number).scale
+        self._store(device_unit, int(round(self._value(real_value) * scale)))
+        return 0
+
+    def CC_GetRealValueFromDeviceUnit(self, serial_number, device_unit, real_value, unit_type):
+        scale = self._device(serial_number).scale
+        self._store(real_value, self._value(device_unit) / scale)
+        return 0
+
+    def CC_GetVelParams(self, serial_number, acceleration, velocity):
+        device = self._device(serial_number)
+        self._store(acceleration, int(round(device.acceleration * device.scale)))
+        self._store(velocity, int(round(device.axis.velocity * device.scale)))
+        return 0
+
+    def CC_SetVelParams(self, serial_number, acceleration, velocity):
+        device = self._device(serial_number)
+        device.acceleration = self._value(acceleration) / device.scale
+        device.axis.velocity = self._value(velocity) / device.scale
+        return 0
+
+    def CC_RequestPosition(self, serial_number):
+        return 0
+
+    def CC_GetPosition(self, serial_number):
+        device = self._device(serial_number)
+        return int(round(device.axis.position() * device.scale))
+
+    def CC_MoveToPosition(self, serial_number, device_unit):
+        device = self._device(serial_number)
+        with self._lock:
+            end_time = device.axis.move(self._value(device_unit) / device.scale)
+            device.pending = (end_time, 2, 1)
+        return 0
+
+    def CC_Home(self, serial_number):
+        device = self._device(serial_number)
+        with self._lock:
+            device.pending = (device.axis.move(0.0), 2, 0)
+        return 0
+
+    def CC_ClearMessageQueue(self, serial_number):
+        device = self._device(serial_number)
+        with self._lock:
+            self._post_messages(device)
+            device.messages = []
+
+    def CC_MessageQueueSize(self, serial_number):
+        device = self._device(serial_number)
+        with self._lock:
+            self._post_messages(device)
+            return len(device.messages)
+
+    def CC_GetNextMessage(self, serial_number, message_type, message_id, message_data):
+        device = self._device(serial_number)
+        with self._lock:
+            self._post_messages(device)
+            if not device.messages:
+                return False
+            received_type, received_id = device.messages.pop(0)
+        self._store(message_type, received_type)
+        self._store(message_id, received_id)
+        self._store(message_data, 0)
+        return True
+
+
+class SimulatedSerialConnection:
+    """ Stand-in for connections.SerialConnection. Commands are answered by
+    handle() of a controller subclass, replies are read with read_all or
+    read_until like from the serial port. axes maps controller axis ids to
+    the bench axes they move, e.g. {1: 'Z'}. """
+    controller_axes = (1,)
+    identify_command = '*IDN?'
+
+    def __init__(
+        self,
+        bench=None,
+        axes=None,
+        get_instrument_id=False,
+        terminating_char='\n',
+        **serial_kwargs
+    ):
+        self.bench = bench if bench is not None else get_bench()
+        self.terminating_char = terminating_char
+        self.get_instrument_id = get_instrument_id
+        self.connected = True
+        self.IDN = ''
+        self._reply = ''
+        self._lock = threading.Lock()
+        self.axes = {str(axis): SimulatedAxis(self.bench)
+                     for axis in self.controller_axes}
+        for axis, bench_axis in (axes or {}).items():
+            self.bench.add_axis(bench_axis, self.axes[str(axis)].position)
+        if self.get_instrument_id:
+            self.IDN = self.transaction(self.identify_command)
+            print('Connected to: %s' % self.IDN)
+
+    def close_connection(self):
+        self.connected = False
+
+    def send(self, command, raw_bytes=False):
+        if isinstance(command, bytes):
+            command = command.decode()
+        self.bench.delay(0.5)
+        with self._lock:
+            reply = self.handle(command.rstrip(self.terminating_char + '\r'))
+            if reply is not None:
+                self._reply += reply + self.terminating_char
+
+    def read_until(self, raw_bytes=False):
+        with self._lock:
+            reply, separator, self._reply = \
+                self._reply.partition(self.terminating_char)
+        reply += separator
+        self.bench.delay(0.5, len(reply))
+        return reply.encode() if raw_bytes else reply
+
+    def read_all(self, raw_bytes=False):
+        with self._lock:
+            reply = self._reply
+            self._reply = ''
+        self.bench.delay(0.5, len(reply))
+        return reply.encode() if raw_bytes else reply
+
+    def transaction(self, command, delay=0.05, raw_bytes=False):
+        # the reply is ready at once, the latency of the bench replaces delay
+        self.send(command, raw_bytes=raw_bytes)
+        return self.read_all(raw_bytes=raw_bytes)
+
+    def handle(self, command):
+        raise NotImplementedError
+
+
+class SimulatedESP300(SimulatedSerialConnection):
+    """ Newport ESP300 commands used by motion_controllers.ESP300_Control,
+    '<axis><command><argument>', e.g. '1PA5.0' or '2TP'. """
+    controller_axes = (1, 2, 3)
+    identify_command = '1ID?'
+    travel_limit = 25.0
+
+    def handle(self, command):
+        match = re.match(r'^(\d*)(M[TZ][+\-]|[A-Z]{2}\??)(.*)$', command.strip().upper())
+        if match is None:
+            return None
+        axis_id, name, argument = match.groups()
+        axis = self.axes.get(axis_id or '1', self.axes['1'])
+        if name == 'ID?':
+            return 'ESP300 Version 3.08 SIMULATED'
+        if name == 'TP':
+            return '%.5f' % axis.position()
+        if name == 'TV':
+            return '%.5f' % (axis.velocity if axis.is_moving() else 0.0)
+        if name == 'VU?':
+            return '%.5f' % axis.velocity
+        if name == 'TE?':
+            return '0'
+        if name == 'TB?':
+            return '0, 0, NO ERROR DETECTED'
+        if name == 'PA':
+            axis.move(float(argument))
+        elif name == 'PR':
+            axis.move(axis.target() + float(argument))
+        elif name == 'OR':
+            axis.move(0.0)
+        elif name == 'DH':
+            axis.set_position(0.0)
+        elif name == 'ST':
+            axis.stop()
+        elif name == 'MT+':
+            axis.move(self.travel_limit)
+        elif name == 'MT-':
+            axis.move(-self.travel_limit)
+        elif name in ('VA', 'VU'):
+            axis.velocity = float(argument)
+        return None
+
+
+class SimulatedPI_E873(SimulatedSerialConnection):
+    """ PI GCS commands used by motion_controllers.PI_E873_3QTU, e.g.
+    'MOV 1 5.0', 'MOV? 1' or chr(5) for the motion status. """
+    controller_axes = (1, 2, 3)
+
+    def _axis_ids(self, arguments):
+        return [axis for axis in arguments if axis in self.axes] or \
+            list(self.axes)
+
+    def handle(self, command):
+        if command == chr(5):
+            moving = 0
+            for bit, axis in enumerate(self.axes.values()):
+                if axis.is_moving():
+                    moving |= 1 << bit
+            return '%x' % moving
+        if command in (chr(4), chr(7), chr(8)):
+            return '0'
+        if command == chr(24):
+            for axis in self.axes.values():
+                axis.stop()
+            return None
+        if not command.strip():
+            return None
+        name, *arguments = command.split()
+        name = name.upper()
+        if name == '*IDN?':
+            return 'Physik Instrumente, E-873.3QTU, SIMULATED, 1.0.0'
+        if name == 'ERR?':
+            return '0'
+        if name in ('MOV?', 'POS?', 'ONT?', 'SVO?', 'FRF?'):
+            replies = []
+            for axis_id in self._axis_ids(arguments):
+                axis = self.axes[axis_id]
+                value = {'MOV?': '%.6f' % axis.target(),
+                         'POS?': '%.6f' % axis.position(),
+                         'ONT?': str(int(not axis.is_moving()))}.get(name, '1')
+                replies.append('%s=%s' % (axis_id, value))
+            return '\n'.join(replies)
+        if name.endswith('?'):
+            return '0'
+        pairs = list(zip(arguments[0::2], arguments[1::2]))
+        if name == 'MOV':
+            for axis_id, position in pairs:
+                self.axes[axis_id].move(float(position))
+        elif name == 'MVR':
+            for axis_id, distance in pairs:
+                axis = self.axes[axis_id]
+                axis.move(axis.target() + float(distance))
+        elif name == 'POS':
+            for axis_id, position in pairs:
+                self.axes[axis_id].set_position(float(position))
+        elif name in ('FRF', 'GOH'):
+            for axis_id in self._axis_ids(arguments):
+                self.axes[axis_id].move(0.0)
+        elif name in ('HLT', 'STP'):
+            for axis_id in self._axis_ids(arguments):
+                self.axes[axis_id].stop()
+        return None
+
+
+controllers = {'ESP300': SimulatedESP300, 'PI_E873': SimulatedPI_E873}
+
+
+def simulated_connection(controller, **connection_kwargs):
+    """ Returns the simulated connection of controller, a key of
+    controllers. """
+    return controllers[controller](**connection_kwargs)
@@ -0,0 +1,22 @@
+import os
+import sys
+from ctypes import c_char_p
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from hardware.instrumentComponent import instrumentHandler
+
+
+#scope ScanOsc and Kinesis controller ScanStage on the simulated bench, stages is [[stageName,stageType,axis],...]
+def simulatedHandler(stages=None):
+    if stages is None:
+        stages = [[f'{axis}-Stage','linear',axis] for axis in ['X','Y','Z']]
+    instHandler = instrumentHandler({'latency':0.0005,'recordLength':10000,'stageVelocity':50.0,'seed':0})
+    stageData = [[name,stageType,c_char_p(str(number).encode()),axis] for number,(name,stageType,axis) in enumerate(stages)]
+    instHandler.add_instrument(['Tektronix_DPO4102B','ScanOsc',{'ipAddress':'simulated'}])
+    instHandler.add_instrument(['KinesisController','ScanStage',{'createStages':True,'stageData':stageData,'homeStages':False}])
+    return instHandler
+
+
+def outputSettings(**settings):
+    return dict({'flushInterval':100,'backgroundWriter':True,'writeQueueSize':16,'stepFileFormat':'none','storageMode':'volts'},**settings)
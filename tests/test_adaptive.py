@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import experiment
+from conftest import outputSettings,simulatedHandler
+from experiment import Experiment,ExperimentOutput
+from utils.adaptive import ScanFeedback
+from utils.modules import Scanner
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),'data_processing'))
+from oscdata import OscData
+
+
+def test_pipelined_adaptive_scan_does_not_wait_for_feedback_timeout(tmp_path,monkeypatch):
+    timeout = 20
+    results = []
+    class RecordingFeedback(ScanFeedback):
+        def __init__(self,window=None):
+            super().__init__(window,timeout)
+        def wait(self,points):
+            values = super().wait(points)
+            results.append(values)
+            return values
+    monkeypatch.setattr(experiment,'ScanFeedback',RecordingFeedback)
+    scanner = Scanner('AdaptiveScan',['X','Y'],[8.5,13,0],[9.5,14,0],[0.5,0.5,1],'ScanStage','ScanOsc',0.01,1000,
+                      waitMode='event',pipelined=True,adaptiveWindow=[4500,5500],adaptiveBudget=25,adaptiveLevels=1)
+    exp = Experiment('adaptive',instHandler=simulatedHandler(),scanner=scanner,output=ExperimentOutput('adaptive',str(tmp_path),outputSettings()))
+    exp.loadScanner()
+    start = time.perf_counter()
+    exp.runExperiment()
+    assert time.perf_counter()-start < timeout
+    #the coarse pass and the refinement pass both reported every point
+    assert len(results) == 2
+    for values in results:
+        assert not any(np.isnan(value) for value in values.values())
+    #every point is stored with the coordinates it was planned at, in the order it was measured
+    planned = [point for values in results for point in values]
+    data = OscData(os.path.join(exp._output._directory,'OscData.hdf5'))
+    assert len(data) == len(planned)
+    assert data.positions.shape == (len(planned),2)
+    assert np.allclose(data.positions,planned)
+    data.close()
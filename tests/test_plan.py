@@ -0,0 +1,18 @@
+import pytest
+
+from utils.modules import Scanner
+
+
+@pytest.mark.parametrize('settings',[{'waitMode':'event'},{'waitMode':'fixed'},{'waitMode':'event','serpentine':True},
+                                     {'waitMode':'event','parallelMoves':True},{'fastFrame':True}])
+def test_every_read_follows_a_settle_after_the_last_move(settings):
+    scanner = Scanner('3DScan',['X','Y','Z'],[8,13,0],[9,14,1],[1,1,1],'ScanStage','ScanOsc',0.1,1000,**settings)
+    moved = False
+    for action in scanner.compile():
+        if action._actionType in ['MoveStage','MoveStages']:
+            moved = True
+        #the Wait [0.5] of the fixed mode after stopping the scope is not a settle, stageSettleTime is 0.1
+        elif action._actionType in ['WAIT_ACQ','Wait'] and action._actionData[0] != 0.5:
+            moved = False
+        elif action._actionType in ['GET_DATA','TRIGGER_FRAME']:
+            assert not moved
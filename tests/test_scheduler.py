@@ -0,0 +1,32 @@
+import os
+
+import h5py
+
+from conftest import outputSettings,simulatedHandler
+from experiment import Experiment,ExperimentOutput
+from utils.scheduler import ActionScheduler
+
+
+def test_hand_written_plan_overlaps_wiregrid_and_stage_moves(tmp_path):
+    instHandler = simulatedHandler([['X-Stage','linear','X'],['Y-Stage','linear','Y'],['wiregrid','rotational','R']])
+    exp = Experiment('plan',instHandler=instHandler,output=ExperimentOutput('plan',str(tmp_path),outputSettings()))
+    exp.addAction('ScanStage','MoveStage',['wiregrid',[45]],waitFor=[])
+    exp.addAction('ScanStage','MoveStage',['X-Stage',[9]],waitFor=[])
+    exp.addAction('ScanStage','MoveStage',['Y-Stage',[13.5]],waitFor=[])
+    exp.addAction('ScanOsc','GET_DATA',[2])
+    nodes = list(ActionScheduler(instHandler).graph(exp._actions))
+    #the three moves run at the same time, the read waits for all of them
+    assert [node.dependencies for node in nodes[:3]] == [[],[],[]]
+    assert sorted(node.index for node in nodes[3].dependencies) == [0,1,2]
+    estimate = ActionScheduler(instHandler).estimate(exp._actions)
+    assert estimate['total'] < estimate['serial']
+
+
+def test_hand_written_plan_stores_no_scan_grid(tmp_path):
+    exp = Experiment('plan',instHandler=simulatedHandler(),output=ExperimentOutput('plan',str(tmp_path),outputSettings()))
+    exp.addAction('ScanStage','MoveStage',['X-Stage',[9]])
+    exp.addAction('ScanOsc','GET_DATA',[2])
+    exp.runExperiment()
+    with h5py.File(os.path.join(exp._output._directory,'OscData.hdf5'),'r') as file:
+        assert file['ydata'].shape[0] == 1
+        assert 'coordinates' not in file
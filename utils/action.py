@@ -1,7 +1,14 @@
 class Action():
-    def __init__(self,instName,actionType,actionData):
+    #waitFor is only used by the scheduler (utils/scheduler.py): None waits for every earlier action,
+    #a list of instrument names only waits for the latest earlier actions on those instruments
+    #index is only set on data actions of a scan: the grid index (one entry per scan axis) of every record they return,
+    #position holds the coordinates of every record instead when the points are not on a grid (adaptive scans)
+    def __init__(self,instName,actionType,actionData,waitFor=None,index=None,position=None):
         self._actionType= actionType
         self._actionData = actionData
         self._instName = instName
+        self._waitFor = waitFor
+        self._index = index
+        self._position = position
     def __repr__(self):
-        return(f'Instrument:{self._instName},Action Type:{self._actionType},Action Data:{self._actionData}')
\ No newline at end of file
+        return(f'Instrument:{self._instName},Action Type:{self._actionType},Action Data:{self._actionData}')
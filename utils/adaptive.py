@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+
+
+#integrated signal of one record like data_processing/heatmap.py: the part of the trace above its median, summed
+def pointSignal(waveform,window=None):
+    ydata = np.asarray(waveform[1],dtype='f8')
+    if window is not None:
+        ydata = ydata[...,window[0]:window[1]]
+    return float(np.sum(np.clip(ydata-np.median(ydata,axis=-1,keepdims=True),0,None)))
+
+
+class ScanFeedback():
+    """Collects the signal of every measured point of a running adaptive
+    scan. The plan generator blocks in wait() until the points it planned
+    have been measured; points that never report (failed reads, stopped
+    scans) count as NaN after timeout seconds."""
+
+    def __init__(self,window=None,timeout=60):
+        self._window = window
+        self._timeout = timeout
+        self._values = {}
+        self._condition = threading.Condition()
+
+    def record(self,point,waveform):
+        value = np.nan if waveform is None else pointSignal(waveform,self._window)
+        with self._condition:
+            self._values[point] = value
+            self._condition.notify_all()
+
+    def wait(self,points):
+        with self._condition:
+            self._condition.wait_for(lambda: all(point in self._values for point in points),self._timeout)
+            return {point:self._values.get(point,np.nan) for point in points}
+
+
+class QuadtreeRefiner():
+    """Plans the points of an adaptive 2D scan. The coarse pass is the full
+    grid xCoords x yCoords; every refinement splits the cells whose corners
+    reach threshold*max or differ by more than gradient*max into four and
+    adds the new corners, until levels refinements or budget points."""
+
+    def __init__(self,xCoords,yCoords,threshold=0.5,gradient=0.25,budget=2000,levels=3):
+        self._xCoords = list(xCoords)
+        self._yCoords = list(yCoords)
+        self._threshold = threshold
+        self._gradient = gradient
+        self._budget = budget
+        self._levels = levels
+        self._level = 0
+        self._values = {}
+        self._cells = [(x0,x1,y0,y1) for x0,x1 in zip(self._xCoords[:-1],self._xCoords[1:]) for y0,y1 in zip(self._yCoords[:-1],self._yCoords[1:])]
+
+    def coarsePoints(self):
+        return [(x,y) for x in self._xCoords for y in self._yCoords][:self._budget]
+
+    @staticmethod
+    def _point(x,y):
+        #midpoints of shared edges are computed from the same corners, rounding only guards against printing noise
+        return (round(x,9),round(y,9))
+
+    def refine(self,values):
+        self._values.update(values)
+        self._level += 1
+        known = [value for value in self._values.values() if not np.isnan(value)]
+        if self._level > self._levels or not known or max(known) <= 0:
+            return []
+        peak = max(known)
+        scored = []
+        for cell in self._cells:
+            x0,x1,y0,y1 = cell
+            corners = [self._values.get(point,np.nan) for point in [(x0,y0),(x0,y1),(x1,y0),(x1,y1)]]
+            corners = [value for value in corners if not np.isnan(value)]
+            if corners and (max(corners) >= self._threshold*peak or max(corners)-min(corners) >= self._gradient*peak):
+                scored.append((max(corners),cell))
+        #the strongest cells are refined first when the budget runs out
+        scored.sort(key=lambda item: -item[0])
+        cells = []
+        points = []
+        planned = set(self._values)
+        for score,(x0,x1,y0,y1) in scored:
+            xm,ym = self._point((x0+x1)/2,(y0+y1)/2)
+            new = [point for point in [(xm,y0),(xm,y1),(x0,ym),(x1,ym),(xm,ym)] if point not in planned]
+            if len(planned)+len(new) > self._budget:
+                break
+            planned.update(new)
+            points += new
+            cells += [(x0,xm,y0,ym),(x0,xm,ym,y1),(xm,x1,y0,ym),(xm,x1,ym,y1)]
+        self._cells = cells
+        #row by row to keep the stage travel short
+        return sorted(points)
@@ -4,7 +4,7 @@ import shutil
 
 def create_config(dir_name):
     ############add files that need to be copied to new folder of experiment#########
-    files_to_copy = ["replay.py","replay.bat","heatmap_plot.bat","heatmap.py"]
+    files_to_copy = ["replay.py","replay.bat","heatmap_plot.bat","heatmap.py","oscdata.py"]
     for file in files_to_copy:
         shutil.copyfile(file, os.path.join(dir_name,file))
     ###############copying the config file###########################################
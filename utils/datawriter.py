@@ -0,0 +1,164 @@
+import queue
+import threading
+import h5py
+import numpy as np
+
+
+class HDF5Writer():
+    """Keeps OscData.hdf5 open for a whole experiment and appends every
+    oscilloscope record as one row of a single resizable dataset
+    (step x point, or step x channel x point when several channels are
+    read per step).
+
+    storageMode 'volts' stores the scaled voltages as float32 in 'ydata'
+    and the time base, which is identical for every step, once in
+    'time_base'. storageMode 'raw' stores the digitizer codes in 'codes'
+    with their own integer type and the waveform preamble
+    (YMU/YOF/YZE/XINC/XZE) once as attributes of that dataset; use
+    data_processing/oscdata.py to read either layout as volts.
+
+    Records written with a grid index also store it as a row of 'indices'
+    (step x axis, -1 where a record had no index), so scans that do not
+    visit the grid in order can be put back into grid order. Fly scans
+    also store the reconstructed stage position of every record in
+    'positions' (NaN where a record had none). The coordinates of every
+    scan axis are stored up front in the 'coordinates' group, one dataset
+    per axis, with the axis order of the grid indices in its 'axes'
+    attribute."""
+    _preambleKeys = ['YMU','YOF','YZE','XINC','XZE']
+
+    def __init__(self,fileName,expectedSteps=None,flushInterval=100,storageMode='volts',coordinates=None):
+        if storageMode not in ['volts','raw']:
+            raise ValueError(f'Unknown storage mode {storageMode}')
+        self._fileName = fileName
+        self._expectedSteps = expectedSteps
+        self._flushInterval = flushInterval
+        self._storageMode = storageMode
+        #never overwrite the data of an earlier run
+        self._file = h5py.File(self._fileName,"w-")
+        self._file.attrs['storageMode'] = storageMode
+        if coordinates:
+            group = self._file.create_group('coordinates')
+            group.attrs['axes'] = list(coordinates)
+            for axis,coords in coordinates.items():
+                group.create_dataset(axis,data=np.asarray(coords,dtype='f8'))
+        self._data = None
+        self._extra = {}
+        self._count = 0
+
+    def _createDataset(self,name,row,dtype,channels=None):
+        rowShape = np.shape(row)
+        #chunks of roughly 1 MB, but never more rows than we expect to write
+        chunkRows = max(1,min(2**20//(np.dtype(dtype).itemsize*int(np.prod(rowShape))),self._expectedSteps or 2**20))
+        self._chunkRows = chunkRows
+        rows = self._expectedSteps if self._expectedSteps else chunkRows
+        dataset = self._file.create_dataset(name,shape=(rows,)+rowShape,maxshape=(None,)+rowShape,chunks=(chunkRows,)+rowShape,dtype=dtype)
+        if channels:
+            dataset.attrs['channels'] = channels
+        return dataset
+
+    def _rawRow(self,waveform):
+        if not hasattr(waveform,'codes'):
+            raise ValueError("storageMode 'raw' needs the oscilloscope to return a Waveform")
+        preamble = [waveform.preamble[key] for key in self._preambleKeys]
+        if self._data is None:
+            self._data = self._createDataset('codes',waveform.codes,waveform.codes.dtype,waveform.channels)
+            for key,value in zip(self._preambleKeys,preamble):
+                self._data.attrs[key] = value
+        elif not all(np.array_equal(value,self._data.attrs[key]) for key,value in zip(self._preambleKeys,preamble)):
+            raise ValueError("Oscilloscope scaling changed during the experiment, use storageMode 'volts'")
+        return waveform.codes
+
+    #per record values next to the data, rows of records written without a value keep the fill value
+    def _writeExtra(self,name,value,dtype,fillvalue):
+        dataset = self._extra.get(name)
+        if dataset is None:
+            shape = np.shape(value)
+            dataset = self._file.create_dataset(name,shape=(self._data.shape[0],)+shape,maxshape=(None,)+shape,chunks=(self._chunkRows,)+shape,dtype=dtype,fillvalue=fillvalue)
+            self._extra[name] = dataset
+        if self._count >= dataset.shape[0]:
+            dataset.resize(self._data.shape[0],axis=0)
+        dataset[self._count] = value
+
+    def write(self,waveform,index=None,position=None):
+        if self._storageMode == 'raw':
+            row = self._rawRow(waveform)
+        else:
+            row = waveform[1]
+            if self._data is None:
+                self._file.create_dataset('time_base',data=np.asarray(waveform[0],dtype='f8'))
+                self._data = self._createDataset('ydata',row,'f4',getattr(waveform,'channels',None))
+        if self._count >= self._data.shape[0]:
+            self._data.resize(max(2*self._data.shape[0],self._count+self._chunkRows),axis=0)
+        self._data[self._count] = row
+        if index is not None:
+            self._writeExtra('indices',index,'i4',-1)
+        if position is not None:
+            self._writeExtra('positions',position,'f8',np.nan)
+        self._count += 1
+        if self._flushInterval and self._count%self._flushInterval==0:
+            self._file.flush()
+        return self._count
+
+    def flush(self):
+        self._file.flush()
+
+    def setAttribute(self,name,value):
+        self._file.attrs[name] = value
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._data is not None:
+            #drop the pre-allocated rows that were never written
+            self._data.resize(self._count,axis=0)
+        for dataset in self._extra.values():
+            dataset.resize(self._count,axis=0)
+        self._file.attrs['numSteps'] = self._count
+        self._file.close()
+        self._file = None
+
+
+class BackgroundWriter():
+    """Calls writeFunc on a separate thread so disk writes do not block the
+    action loop. put() blocks once maxQueueSize items are waiting, which
+    throttles the scan instead of buffering records without bound when the
+    disk falls behind. close() drains everything that was queued."""
+    _stop = object()
+
+    def __init__(self,writeFunc,maxQueueSize=16):
+        self._writeFunc = writeFunc
+        self._queue = queue.Queue(maxsize=maxQueueSize)
+        self._error = None
+        self._errorRaised = False
+        self._thread = threading.Thread(target=self._run,name='BackgroundWriter',daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._stop:
+                break
+            #after a failure keep consuming so that put() never blocks forever
+            if self._error is None:
+                try:
+                    self._writeFunc(*item)
+                except Exception as error:
+                    self._error = error
+
+    def _raiseError(self):
+        if self._error is not None and not self._errorRaised:
+            self._errorRaised = True
+            raise self._error
+
+    def put(self,*args):
+        self._raiseError()
+        self._queue.put(args)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(self._stop)
+        self._thread.join()
+        self._thread = None
+        self._raiseError()
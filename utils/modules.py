@@ -1,56 +1,261 @@
 from .action import Action
+from .adaptive import QuadtreeRefiner
+import numpy as np
+
+#points from start to stop (included when it lies on the grid) in steps of step, counted on integers so no point is lost to
+#rounding, the rounding to 12 decimals only removes the binary noise of the multiplication (0.30000000000000004)
+def gridCoords(start,stop,step):
+    count = int(np.floor((stop-start)/step+1e-9))+1
+    return np.round(start+step*np.arange(count,dtype='f8'),12)
 
 class Scanner():
-    def __init__(self,mod_type,axes,startCoords,stopCoords,steps,scanStage,scanReader,stageSettleTime,resolution):
+    def __init__(self,mod_type,axes,startCoords,stopCoords,steps,scanStage,scanReader,stageSettleTime,resolution,channels=[2],fastFrame=False,waitMode='fixed',settleAcquisitions=None,waitTimeout=5,pipelined=False,serpentine=False,flyVelocity=1.0,flyPollInterval=0.02,adaptiveThreshold=0.5,adaptiveGradient=0.25,adaptiveBudget=2000,adaptiveLevels=3,adaptiveWindow=None,scanAxes=None,scanOrder=None,parallelMoves=False):
         self._type = mod_type
-        type_dict = {'1DScan': self.scan1D,'2DScan':self.scan2D ,'3DScan':self.scan3D}
+        type_dict = {'1DScan': self.scan1D,'2DScan':self.scan2D ,'3DScan':self.scan3D,'FlyScan':self.flyScan,'AdaptiveScan':self.adaptiveScan,'NDScan':self.ndScan}
         self._axisMap = {'X':0,'Y':1,'Z':2}
         self._static  = type_dict[mod_type]
         type_dict.clear()
         self._axes = axes
+        #scanAxes replaces axes/startCoords/stopCoords/steps with named stages (any number, rotation stages included):
+        #every entry is [stageName,start,stop,step] or [stageName,coordinates] with a list/array or the path of a .npy file,
+        #scanOrder lists the stages from the outermost to the innermost axis
+        self._axisStages = {}
+        self._axisCoords = {}
+        if scanAxes:
+            for axis in scanAxes:
+                self._axisStages[axis[0]] = axis[0]
+                self._axisCoords[axis[0]] = self.loadCoords(axis[1:])
+            self._axes = list(scanOrder) if scanOrder else [axis[0] for axis in scanAxes]
+            if sorted(self._axes) != sorted(self._axisStages):
+                raise ValueError(f'scanOrder {scanOrder} has to list every stage of scanAxes once')
+        elif mod_type == 'NDScan':
+            raise ValueError('NDScan needs scanAxes')
+        else:
+            for axis in axes:
+                index = self._axisMap[axis]
+                self._axisCoords[axis] = gridCoords(startCoords[index],stopCoords[index],steps[index])
+        for axis,coords in self._axisCoords.items():
+            if not len(coords):
+                raise ValueError(f'Axis {axis} of the scan has no points')
         self.startCoords = startCoords
         self.stopCoords = stopCoords
         self.steps = steps
         self.scanStage = scanStage
         self.scanReader = scanReader
         self.stageSettleTime =stageSettleTime
+        #a single channel is read as before, several channels are read from the same acquisition in one GET_DATA
+        self.readChannel = channels[0] if len(channels)==1 else list(channels)
+        #a fly scan moves the last axis at flyVelocity without stopping while the scope records a FastFrame frame every step,
+        #the frame positions are reconstructed from the stage positions polled every flyPollInterval seconds
+        self.flying = mod_type == 'FlyScan'
+        self.flyVelocity = flyVelocity
+        self.flyPollInterval = flyPollInterval
+        #an adaptive scan measures the grid of the first two axes and then refines around the points with signal above
+        #adaptiveThreshold*max or a difference above adaptiveGradient*max, see utils/adaptive.py
+        self.adaptive = mod_type == 'AdaptiveScan'
+        self.adaptiveThreshold = adaptiveThreshold
+        self.adaptiveGradient = adaptiveGradient
+        self.adaptiveBudget = adaptiveBudget
+        self.adaptiveLevels = adaptiveLevels
+        self.adaptiveWindow = adaptiveWindow
+        #FastFrame frames are recorded on forced triggers, the pulse is not at a fixed sample, so adaptiveWindow would
+        #integrate arbitrary samples of them
+        if self.adaptive and fastFrame:
+            raise ValueError('AdaptiveScan integrates adaptiveWindow of triggered traces and cannot be combined with fastFrame')
+        #ScanFeedback of the running experiment, without it an adaptive plan only holds the coarse pass
+        self.feedback = None
+        #with fastFrame every point of a line is recorded as a FastFrame frame and the whole line is transferred at its end
+        self.fastFrame = fastFrame or self.flying
+        #'fixed' sleeps for stageSettleTime/0.5 s, 'event' waits until the scope has a fresh acquisition/is ready and only sleeps if it times out
+        if waitMode not in ['fixed','event']:
+            raise ValueError(f'Unknown wait mode {waitMode}')
+        self.waitMode = waitMode
+        #new acquisitions to wait for after a move in 'event' mode, None for one or as many as the scope averages
+        self.settleAcquisitions = settleAcquisitions
+        self.waitTimeout = waitTimeout
+        #a pipelined plan moves the stage to the next point while the current trace is transferred, run it with utils/scheduler.py
+        self.pipelined = pipelined
+        #with parallelMoves stage moves that follow each other are sent as one MoveStages that moves the stages at the same time
+        self.parallelMoves = parallelMoves
+        #a serpentine scan runs the inner axes backwards on every other line instead of moving them back to the start
+        self.serpentine = serpentine
+        #resolution is no longer used, the coordinates are counted on an integer grid by gridCoords
         self._resolution = resolution
         self._actions = []
 
-    def scan(self,axis,actions):
-        temp_actions =[]
-        index = self._axisMap[axis]
-        startCoords = self.startCoords[index]
-        stopCoords = self.stopCoords[index]
-        steps = self.steps[index]
-        temp_actions.append(Action(self.scanStage,'MoveStage',[f'{axis}-Stage',[startCoords]]))
-        coords = []
-        for step in range(int((startCoords+steps)*self._resolution),int((stopCoords+steps)*self._resolution),int(steps*self._resolution)):
-            temp_actions+=actions
-            coord = step/self._resolution
-            temp_actions.append(Action(self.scanStage,'MoveStage',[f'{axis}-Stage',[step]]))
-            temp_actions.append(Action('SYSTEM','Wait',[self.stageSettleTime]))
-        temp_actions+=actions
-        coords.append(coord)
-        return [temp_actions,coords]
+    @staticmethod
+    def loadCoords(spec):
+        if len(spec) == 3:
+            return gridCoords(*spec)
+        coords = spec[0]
+        if isinstance(coords,str):
+            coords = np.load(coords)
+        return np.asarray(coords,dtype='f8').ravel()
+
+    def stageOf(self,axis):
+        return self._axisStages.get(axis,f'{axis}-Stage')
+
+    #coordinates of the points of an axis, in scan order
+    def axisCoords(self,axis):
+        return self._axisCoords[axis].tolist()
+
+    #axes the scan type visits, in the order of the grid indices
+    def scannedAxes(self):
+        count = {'1DScan':1,'2DScan':2,'3DScan':3,'AdaptiveScan':2}.get(self._type,len(self._axes))
+        return self._axes[:count]
+
+    #coordinates of every scanned axis, known before the scan starts (the coarse grid of an adaptive scan)
+    def coordinates(self):
+        return {axis:self._axisCoords[axis] for axis in self.scannedAxes()}
+
+    #point order of the next traversal of an axis, in serpentine mode every other traversal runs backwards
+    def lineOrder(self,axis,lines):
+        count = lines.get(axis,0)
+        lines[axis] = count+1
+        order = list(range(self.numPoints(axis)))
+        if self.serpentine and count%2:
+            order.reverse()
+        return order
+
+    #yields the plan of one axis lazily, inner is called with the grid index of every point and returns the fresh
+    #actions to run there, lines counts the traversals of every axis during one iteration of the plan
+    def scan(self,axis,inner,index=(),lines=None):
+        if lines is None:
+            lines = {}
+        first = axis not in lines
+        targets = self.axisCoords(axis)
+        for count,point in enumerate(self.lineOrder(axis,lines)):
+            #a serpentine line starts where the previous one ended, so the stage does not have to move back
+            moved = count > 0 or first or not self.serpentine
+            actions = iter(inner(index+(point,)))
+            if moved:
+                yield Action(self.scanStage,'MoveStage',[self.stageOf(axis),[targets[point]]])
+                #every move settles before the next read, if the inner axis moves to the start of its line right
+                #after this move it settles once after its own move
+                nextAction = next(actions,None)
+                if nextAction is None or not (nextAction._instName == self.scanStage and nextAction._actionType == 'MoveStage'):
+                    yield self.add_settle_action()
+                if nextAction is not None:
+                    yield nextAction
+            yield from actions
         
-    def add_read_actions(self):
+    def add_settle_action(self):
+        #in FastFrame mode the scope is not acquiring between frames, so there is nothing to wait on
+        if self.waitMode == 'event' and not self.fastFrame:
+            return Action(self.scanReader,'WAIT_ACQ',[self.settleAcquisitions,self.waitTimeout,self.stageSettleTime])
+        return Action('SYSTEM','Wait',[self.stageSettleTime])
+
+    def add_read_actions(self,index=None,position=None):
         actions =[]
         actions.append(Action(self.scanReader,'SET_ACQ_STATE',['STOP']))
-        actions.append(Action('SYSTEM','Wait',[0.5]))
-        actions.append(Action(self.scanReader,'GET_DATA',[2]))
+        if self.waitMode == 'event':
+            actions.append(Action(self.scanReader,'WAIT_READY',[self.waitTimeout,0.5]))
+        else:
+            actions.append(Action('SYSTEM','Wait',[0.5]))
+        actions.append(Action(self.scanReader,'GET_DATA',[self.readChannel],index=None if index is None else [index],position=None if position is None else [position]))
         actions.append(Action(self.scanReader,'SET_ACQ_STATE',['RUN']))
         return actions
 
 
+    def numPoints(self,axis):
+        return len(self._axisCoords[axis])
+
+    #number of records the scan produces, an adaptive scan stops at adaptiveBudget points or earlier
+    def totalPoints(self):
+        if self.adaptive:
+            return self.adaptiveBudget
+        return int(np.prod([self.numPoints(axis) for axis in self.scannedAxes()]))
+
+    #scan of the innermost axis, the read actions are repeated at every point
+    def scanLine(self,axis,index=(),lines=None):
+        if not self.fastFrame:
+            yield from self.scan(axis,self.add_read_actions,index,lines)
+            return
+        numFrames = self.numPoints(axis)
+        frames = []
+        def trigger(point):
+            frames.append(point)
+            return [Action(self.scanReader,'TRIGGER_FRAME',[])]
+        yield Action(self.scanReader,'START_FRAMES',[numFrames])
+        yield from self.scan(axis,trigger,index,lines)
+        yield Action(self.scanReader,'GET_FRAMES',[self.readChannel,numFrames],index=frames)
+
+    #flies over one line of the last axis: the stage moves at flyVelocity while TRIGGER_FRAMES runs on the scope at the
+    #same time, so the plan has to be run by the scheduler
+    def flyLine(self,axis,index=(),lines=None):
+        if lines is None:
+            lines = {}
+        stage = self.stageOf(axis)
+        first = axis not in lines
+        order = self.lineOrder(axis,lines)
+        coords = self.axisCoords(axis)
+        numFrames = len(order)
+        if first or not self.serpentine:
+            yield Action(self.scanStage,'MoveStage',[stage,[coords[order[0]]]])
+            yield self.add_settle_action()
+        yield Action(self.scanStage,'SetVelocity',[stage,self.flyVelocity])
+        yield Action(self.scanReader,'START_FRAMES',[numFrames])
+        yield Action(self.scanStage,'FlyStage',[stage,[coords[order[-1]]],self.flyPollInterval],[self.scanReader])
+        yield Action(self.scanReader,'TRIGGER_FRAMES',[numFrames,(abs(coords[1]-coords[0]) if numFrames>1 else 0)/self.flyVelocity],[])
+        yield Action(self.scanReader,'GET_FRAMES',[self.readChannel,numFrames],index=[index+(point,) for point in order])
+        yield Action(self.scanStage,'SetVelocity',[stage,None])
+
+    #steps the other axes like scan1D/2D/3D and flies over the last one
+    def flyScan(self):
+        return self.nestedScan(self._axes,self.flyLine)
+
+    #moves to an arbitrary point of the first two axes, only the stages whose coordinate changes are moved
+    def visitPoint(self,point,current):
+        moved = False
+        for axis,coord in zip(self._axes[:2],point):
+            if current.get(axis) != coord:
+                yield Action(self.scanStage,'MoveStage',[self.stageOf(axis),[coord]])
+                current[axis] = coord
+                moved = True
+        if moved:
+            yield self.add_settle_action()
+        yield from self.add_read_actions(position=point)
+
+    def adaptiveScan(self):
+        refiner = QuadtreeRefiner(self.axisCoords(self._axes[0]),self.axisCoords(self._axes[1]),self.adaptiveThreshold,self.adaptiveGradient,self.adaptiveBudget,self.adaptiveLevels)
+        feedback = self.feedback
+        current = {}
+        points = refiner.coarsePoints()
+        while points:
+            for point in points:
+                yield from self.visitPoint(point,current)
+            if feedback is None:
+                return
+            points = refiner.refine(feedback.wait(points))
+
+    #passes the result of every data action of an adaptive scan to the running ScanFeedback
+    def observe(self,action,output):
+        if self.feedback is None or action._position is None:
+            return
+        records = output[1] if output and output[0] else [None]*len(action._position)
+        for point,waveform in zip(action._position,records):
+            self.feedback.record(point,waveform)
+
+    #nests a scan of every axis but the last one around line(lastAxis,index,lines), the first axis is the outermost
+    def nestedScan(self,axes,line):
+        lines = {}
+        inner = lambda index: line(axes[-1],index,lines)
+        for axis in reversed(axes[:-1]):
+            inner = (lambda axis,inner: lambda index: self.scan(axis,inner,index,lines))(axis,inner)
+        return inner(())
+
     def scan1D(self):
-        return self.scan(self._axes[0],self.add_read_actions())[0]
+        return self.nestedScan(self._axes[:1],self.scanLine)
 
     def scan2D(self):
-        return self.scan(self._axes[0],self.scan(self._axes[1],self.add_read_actions())[0])[0]
+        return self.nestedScan(self._axes[:2],self.scanLine)
 
     def scan3D(self):
-        return self.scan(self._axes[0],self.scan(self._axes[1],self.scan(self._axes[2],self.add_read_actions())[0])[0])[0]
+        return self.nestedScan(self._axes[:3],self.scanLine)
+
+    #every axis of scanAxes in scanOrder, the read actions run at every point of the innermost axis
+    def ndScan(self):
+        return self.nestedScan(self._axes,self.scanLine)
         
     def get_actions(self):
         return (self._actions)
@@ -60,11 +265,106 @@ class Scanner():
             index = self._axisMap[axis]
             self._actions.append(Action(self.scanStage,'MoveStage',[f'{axis}-Stage',self.startCoords[index]]))
 
+    #instruments each action has to wait for in a pipelined plan, see utils/action.py
+    def pipeline_dependencies(self,action):
+        dependencies = {'MoveStage':[self.scanReader,'SYSTEM'],        #the trace of the current point is frozen
+                        'MoveStages':[self.scanReader,'SYSTEM'],
+                        'GET_DATA':['SYSTEM'],
+                        'SET_ACQ_STATE':[self.scanStage,'SYSTEM'],     #never (re)start or stop the acquisition while moving
+                        'Wait':[self.scanStage,self.scanReader],
+                        'WAIT_READY':[],
+                        'WAIT_ACQ':[self.scanStage]}
+        return dependencies.get(action._actionType)
+
+    #reorders the plan so that the moves following a read are sent before its GET_DATA, and adds the dependencies
+    #that keep the result identical to the serial plan
+    def pipeline(self,actions):
+        pending = []
+        for action in actions:
+            action = Action(action._instName,action._actionType,action._actionData,self.pipeline_dependencies(action),action._index,action._position)
+            if action._instName == self.scanReader and action._actionType == 'GET_DATA':
+                yield from pending
+                pending = [action]
+            elif pending and action._instName == self.scanReader and action._actionType == 'SET_ACQ_STATE':
+                pending.append(action)
+            elif pending and action._actionType in ['MoveStage','MoveStages']:
+                yield action
+            else:
+                yield from pending
+                pending = []
+                yield action
+        yield from pending
+
+    def isSettle(self,action):
+        return (action._instName == 'SYSTEM' and action._actionType == 'Wait') or action._actionType == 'WAIT_ACQ'
+
+    def flushMoves(self,moves,settle):
+        if len(moves) == 1:
+            yield moves[0]
+        elif moves:
+            yield Action(self.scanStage,'MoveStages',[[move._actionData[0] for move in moves],[move._actionData[1][0] for move in moves]])
+        if settle is not None:
+            yield settle
+
+    #combines moves of different stages that follow each other with at most one settle action in between, e.g. the
+    #step of an outer axis and the return of the inner axis to its start, into one MoveStages that moves them at the
+    #same time and settles once
+    def mergeMoves(self,actions):
+        moves = []
+        settle = None
+        for action in actions:
+            if action._instName == self.scanStage and action._actionType == 'MoveStage':
+                if action._actionData[0] not in [move._actionData[0] for move in moves]:
+                    moves.append(action)
+                    continue
+            elif moves and settle is None and self.isSettle(action):
+                settle = action
+                continue
+            yield from self.flushMoves(moves,settle)
+            moves = []
+            settle = None
+            if action._instName == self.scanStage and action._actionType == 'MoveStage':
+                moves.append(action)
+            else:
+                yield action
+        yield from self.flushMoves(moves,settle)
+
+    #the plan is generated while it is iterated, so compiling is instant and memory does not grow with the number of points
+    def plan(self):
+        yield Action(self.scanReader,'ARM_TRANSFER',[self.readChannel])
+        actions = self._static()
+        if self.parallelMoves:
+            actions = self.mergeMoves(actions)
+        #a fly scan has its own dependencies and is never pipelined, neither is an adaptive scan: its plan blocks on the
+        #result of the last read of every pass, which the pipeline would still be holding back
+        if self.pipelined and not self.flying and not self.adaptive:
+            actions = self.pipeline(actions)
+        yield from actions
+        if self.fastFrame:
+            yield Action(self.scanReader,'STOP_FRAMES',[])
+
     def compile(self):
         #self.initiate()
-        self._actions += self._static()
-        #print(self._actions)
-        return(self._actions)
+        return ScanPlan(self)
+
+
+class ScanPlan():
+    """Re-iterable lazy plan of a Scanner, every iteration generates fresh
+    Action objects. Actions added with append() run after the scan."""
+
+    def __init__(self,scanner):
+        self.scanner = scanner
+        self._extra = []
+
+    def __iter__(self):
+        yield from self.scanner.plan()
+        yield from self._extra
+
+    def append(self,action):
+        self._extra.append(action)
 
+    def totalPoints(self):
+        return self.scanner.totalPoints()+sum(1 if action._actionType == 'GET_DATA' else action._actionData[1] for action in self._extra if action._actionType in ('GET_DATA','GET_FRAMES'))
 
-        
\ No newline at end of file
+    def hasDependencies(self):
+        return self.scanner.pipelined or self.scanner.flying or any(action._waitFor is not None for action in self._extra)
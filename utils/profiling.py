@@ -0,0 +1,141 @@
+import csv
+import os
+import threading
+import time
+import h5py
+import numpy as np
+
+
+class Profiler():
+    """Records the duration and size of every action and every VISA
+    transaction of an experiment.
+
+    record(kind,instrument,name,start,end,numBytes) takes time.perf_counter()
+    times and is called by instrumentHandler for every action (kind
+    'action', name the action type) and by the VISA connections for every
+    write or query (kind 'visa', name the command header, bytes sent and
+    received). The bytes of the VISA transactions are also added to the
+    action running on the same thread. Every (kind,instrument,name) keeps
+    a count, total/min/max and a histogram of the durations over
+    logarithmic bins from 1 us to 10000 s, the single events are kept
+    too if keepEvents is set.
+
+    Nothing is wrapped or timed unless a Profiler is set, see
+    instrumentHandler.setProfiler. export() writes profile_summary.csv,
+    profile_histograms.csv, profile_events.csv and profile.hdf5 to the
+    experiment folder, startLive() prints summary() every interval
+    seconds while the experiment runs."""
+    binEdges = np.logspace(-6,4,101)
+
+    def __init__(self,keepEvents=True):
+        self._keepEvents = keepEvents
+        self._events = []
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        #wall clock time of perf_counter() zero
+        self._wallOffset = time.time()-time.perf_counter()
+        self._live = None
+
+    def record(self,kind,instrument,name,start,end,numBytes=0):
+        duration = end-start
+        key = (kind,instrument,name)
+        if kind != 'action' and getattr(self._local,'bytes',None) is not None:
+            self._local.bytes += numBytes
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {'count':0,'total':0.0,'min':np.inf,'max':0.0,'bytes':0,'histogram':np.zeros(len(self.binEdges)+1,dtype='i8')}
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['min'] = min(stats['min'],duration)
+            stats['max'] = max(stats['max'],duration)
+            stats['bytes'] += numBytes
+            #bin 0 is below 1 us, the last bin above 10000 s
+            stats['histogram'][np.searchsorted(self.binEdges,duration,side='right')] += 1
+            if self._keepEvents:
+                self._events.append((kind,instrument,name,start,end,numBytes))
+
+    #runs func(*args) as the action instrument/name, with the bytes of the VISA transactions it makes
+    def timeAction(self,instrument,name,func,*args):
+        self._local.bytes = 0
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            end = time.perf_counter()
+            numBytes = self._local.bytes
+            self._local.bytes = None
+            self.record('action',instrument,name,start,end,numBytes)
+
+    def _percentile(self,histogram,fraction):
+        #upper edge of the bin that holds the fraction of the events, so at most one bin (26%) too high
+        index = int(np.searchsorted(np.cumsum(histogram),fraction*histogram.sum()))
+        return self.binEdges[min(index,len(self.binEdges)-1)]
+
+    def statistics(self):
+        with self._lock:
+            items = [(key,dict(stats,histogram=stats['histogram'].copy())) for key,stats in self._stats.items()]
+        rows = []
+        for (kind,instrument,name),stats in sorted(items,key=lambda item: -item[1]['total']):
+            rows.append({'kind':kind,'instrument':instrument,'name':name,'count':stats['count'],'total':stats['total'],
+                         'mean':stats['total']/stats['count'],'min':stats['min'],'max':stats['max'],
+                         'p50':min(self._percentile(stats['histogram'],0.5),stats['max']),'p95':min(self._percentile(stats['histogram'],0.95),stats['max']),
+                         'bytes':stats['bytes'],'histogram':stats['histogram']})
+        return rows
+
+    def summary(self,top=10):
+        lines = [f"{'kind':6} {'instrument':12} {'name':24} {'count':>8} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'MB':>9}"]
+        for row in self.statistics()[:top]:
+            lines.append(f"{row['kind']:6} {row['instrument']:12} {row['name'][:24]:24} {row['count']:8d} {row['total']:9.2f} "
+                         f"{1e3*row['mean']:9.2f} {1e3*row['p95']:9.2f} {row['bytes']/2**20:9.2f}")
+        return '\n'.join(lines)
+
+    def _liveLoop(self,interval,top):
+        while not self._live.wait(interval):
+            print(self.summary(top))
+
+    def startLive(self,interval,top=10):
+        self.stopLive()
+        self._live = threading.Event()
+        threading.Thread(target=self._liveLoop,args=(interval,top),name='ProfilerSummary',daemon=True).start()
+
+    def stopLive(self):
+        if self._live is not None:
+            self._live.set()
+            self._live = None
+
+    def export(self,directory):
+        rows = self.statistics()
+        columns = ['kind','instrument','name','count','total','mean','min','max','p50','p95','bytes']
+        with open(os.path.join(directory,'profile_summary.csv'),'w',newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows([[row[column] for column in columns] for row in rows])
+        with open(os.path.join(directory,'profile_histograms.csv'),'w',newline='') as file:
+            writer = csv.writer(file)
+            #bin i counts durations from edge i-1 up to edge i, the first bin is below the first edge
+            writer.writerow(['kind','instrument','name']+['<%g'%edge for edge in self.binEdges]+['>=%g'%self.binEdges[-1]])
+            writer.writerows([[row['kind'],row['instrument'],row['name']]+row['histogram'].tolist() for row in rows])
+        with self._lock:
+            events = list(self._events)
+        if self._keepEvents:
+            with open(os.path.join(directory,'profile_events.csv'),'w',newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['kind','instrument','name','start','end','duration','bytes'])
+                writer.writerows([[kind,instrument,name,self._wallOffset+start,self._wallOffset+end,end-start,numBytes]
+                                  for kind,instrument,name,start,end,numBytes in events])
+        with h5py.File(os.path.join(directory,'profile.hdf5'),'w') as file:
+            file.create_dataset('bin_edges',data=self.binEdges)
+            names = np.array([[row['kind'],row['instrument'],row['name']] for row in rows],dtype=h5py.string_dtype()).reshape(-1,3)
+            file.create_dataset('keys',data=names)
+            file.create_dataset('histograms',data=np.array([row['histogram'] for row in rows],dtype='i8').reshape(len(rows),-1))
+            summary = file.create_group('summary')
+            for column in columns[3:]:
+                summary.create_dataset(column,data=np.array([row[column] for row in rows],dtype='f8'))
+            if self._keepEvents:
+                group = file.create_group('events')
+                group.create_dataset('keys',data=np.array([event[:3] for event in events],dtype=h5py.string_dtype()).reshape(-1,3))
+                group.create_dataset('start',data=self._wallOffset+np.array([event[3] for event in events],dtype='f8'))
+                group.create_dataset('duration',data=np.array([event[4]-event[3] for event in events],dtype='f8'))
+                group.create_dataset('bytes',data=np.array([event[5] for event in events],dtype='i8'))
@@ -0,0 +1,99 @@
+import collections
+import sys
+import threading
+import time
+
+
+#phase of every action type, the other actions are 'acquisition', also used by benchmarks/scan_benchmark.py
+phaseOf = {'MoveStage':'move','MoveStages':'move','MoveToCoords':'move','SetVelocity':'move','FlyStage':'move',
+           'Wait':'settle','WAIT_ACQ':'settle','WAIT_READY':'settle',
+           'GET_DATA':'transfer','GET_FRAMES':'transfer'}
+
+
+class ProgressReporter():
+    """Shows how far a running scan is on one console line instead of
+    printing every action and its output.
+
+    done(action,output,seconds,writeSeconds) is called by runExperiment and
+    ActionScheduler after every action with the time the action took and
+    the time addStepData took to hand its output to the writer. Every data
+    action (GET_DATA, GET_FRAMES) counts its records as points. The line
+    shows the points done out of total (Scanner.totalPoints, an upper bound
+    for an adaptive scan), the rate over the last window seconds, the ETA
+    from that rate and the share of the action time spent in every phase.
+    It is redrawn at most every interval seconds, finish() draws it a last
+    time and ends it."""
+    phases = ['move','settle','acquisition','transfer','write']
+
+    def __init__(self,total,interval=0.25,window=10.0,stream=None):
+        self.total = total
+        self.points = 0
+        self.failures = 0
+        self.seconds = {phase:0.0 for phase in self.phases}
+        self._interval = interval
+        self._window = window
+        self._stream = stream if stream is not None else sys.stdout
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._lastReport = self._start
+        #(time,points) after every data action of the last window seconds
+        self._history = collections.deque([(self._start,0)])
+        self._width = 0
+
+    def done(self,action,output,seconds,writeSeconds=0.0):
+        now = time.perf_counter()
+        with self._lock:
+            self.seconds[phaseOf.get(action._actionType,'acquisition')] += seconds
+            self.seconds['write'] += writeSeconds
+            if action._actionType in ('GET_DATA','GET_FRAMES'):
+                if output and output[0] and output[1]:
+                    self.points += len(output[1])
+                else:
+                    self.failures += 1
+                    self.points += action._actionData[1] if action._actionType == 'GET_FRAMES' else 1
+                self._history.append((now,self.points))
+                while len(self._history) > 2 and now-self._history[1][0] > self._window:
+                    self._history.popleft()
+            if now-self._lastReport < self._interval:
+                return
+            self._lastReport = now
+            self._write(self.line(now))
+
+    #points per second over the last window seconds
+    def rate(self):
+        (first,firstPoints),(last,lastPoints) = self._history[0],self._history[-1]
+        if lastPoints == firstPoints or last <= first:
+            return 0.0
+        return (lastPoints-firstPoints)/(last-first)
+
+    def line(self,now=None):
+        now = time.perf_counter() if now is None else now
+        rate = self.rate()
+        if self.total:
+            percent = f' ({100*self.points/self.total:.1f}%)'
+            remaining = max(self.total-self.points,0)
+            eta = formatSeconds(remaining/rate) if rate > 0 else '?'
+        else:
+            percent = ''
+            eta = '?'
+        busy = sum(self.seconds.values())
+        breakdown = ' '.join(f'{phase} {100*seconds/busy:.0f}%' for phase,seconds in self.seconds.items() if busy and seconds)
+        failures = f', {self.failures} failed' if self.failures else ''
+        return (f'{self.points}/{self.total or "?"} points{percent}{failures}, {rate:.2f} points/s, '
+                f'elapsed {formatSeconds(now-self._start)}, ETA {eta} | {breakdown}')
+
+    def finish(self):
+        with self._lock:
+            self._write(self.line(),'\n')
+
+    def _write(self,line,end=''):
+        #pads a shorter line so nothing of the previous one is left over
+        self._stream.write('\r'+line.ljust(self._width)+end)
+        self._stream.flush()
+        self._width = 0 if end else len(line)
+
+
+def formatSeconds(seconds):
+    minutes,seconds = divmod(int(seconds),60)
+    hours,minutes = divmod(minutes,60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
@@ -0,0 +1,167 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Node():
+    def __init__(self,index,action,resources,dependencies):
+        self.index = index
+        self.action = action
+        self.resources = resources
+        self.dependencies = dependencies
+        self.dependents = []
+        self.remaining = 0
+        self.done = False
+
+
+class ActionScheduler():
+    """Runs a plan as a dependency graph so that actions on different
+    resources can overlap, e.g. rotating the wiregrid while X and Y move or
+    the next MoveStage while the scope transfers the current trace.
+
+    A resource is (instName,part): most instruments are a single resource
+    (part None), the Kinesis controller has one per stage, see
+    instrumentHandler.getResources. Every action runs after the earlier
+    actions on its resources. If action._waitFor is None it also waits for
+    every earlier action, so a plan without dependencies runs exactly like
+    the serial loop. If it is a list of instrument names it only waits for
+    the latest earlier action on each resource of those instruments.
+
+    describe() and estimate() build the same graph without running it, the
+    estimate uses durations (seconds per action type, 'Wait' and
+    'TRIGGER_FRAMES' use their own data). At most window actions are dispatched ahead of the ones that
+    have finished. Every finished action is passed to progress (a ProgressReporter) if it is set."""
+    defaultDurations = {'MoveStage':1.0,'MoveStages':1.0,'MoveToCoords':1.0,'GET_DATA':0.2,'GET_FRAMES':1.0,'WAIT_ACQ':0.2,'WAIT_READY':0.1,'SET_ACQ_STATE':0.05}
+
+    def __init__(self,instHandler,output=None,window=64,workers=16,durations=None,progress=None):
+        self._instHandler = instHandler
+        self._output = output
+        self._progress = progress
+        self._window = window
+        self._workers = workers
+        self._durations = dict(self.defaultDurations)
+        if durations:
+            self._durations.update(durations)
+        self._error = None
+        self._lock = threading.Lock()
+
+    def duration(self,action):
+        if action._actionType == 'Wait':
+            return action._actionData[0]
+        if action._actionType == 'TRIGGER_FRAMES':
+            return action._actionData[0]*action._actionData[1]
+        return self._durations.get(action._actionType,0.01)
+
+    def _resources(self,action):
+        return self._instHandler.getResources(action)
+
+    #yields every action as a node together with the earlier nodes it has to wait for
+    def graph(self,actions):
+        last = {}
+        for index,action in enumerate(actions):
+            resources = self._resources(action)
+            if action._waitFor is None:
+                dependencies = list(last.values())
+            else:
+                dependencies = [node for (instName,part),node in last.items() if instName in action._waitFor]
+            for instName,part in resources:
+                #a whole instrument action conflicts with every part of it and the other way round
+                dependencies += [node for (name,other),node in last.items() if name == instName and (part is None or other in (part,None))]
+            node = _Node(index,action,resources,list({id(node):node for node in dependencies}.values()))
+            for instName,part in resources:
+                if part is None:
+                    #the parts are behind this action now
+                    for resource in [key for key in last if key[0] == instName and key[1] is not None]:
+                        del last[resource]
+                last[(instName,part)] = node
+            yield node
+
+    def describe(self,actions):
+        lines = []
+        for node in self.graph(actions):
+            resources = ','.join(instName if part is None else f'{instName}/{part}' for instName,part in node.resources)
+            after = ','.join(str(dependency.index) for dependency in node.dependencies)
+            lines.append(f'{node.index:5d} [{resources}] after [{after}] {node.action}')
+            node.dependencies = None
+        return '\n'.join(lines)
+
+    #earliest finish of every action if all of them took their estimated duration
+    def estimate(self,actions):
+        finish = {}
+        previous = {}
+        total = serial = 0
+        end = None
+        for node in self.graph(actions):
+            start = 0
+            for dependency in node.dependencies:
+                if finish[dependency.index] > start:
+                    start = finish[dependency.index]
+                    previous[node.index] = dependency.index
+            duration = self.duration(node.action)
+            finish[node.index] = start+duration
+            serial += duration
+            if finish[node.index] >= total:
+                total = finish[node.index]
+                end = node.index
+            #dependencies are only needed while the graph is walked
+            node.dependencies = None
+        path = []
+        while end is not None:
+            path.append(end)
+            end = previous.get(end)
+        return {'total':total,'serial':serial,'criticalPath':path[::-1]}
+
+    def _submit(self,executor,node):
+        executor.submit(self._work,executor,node)
+
+    def _work(self,executor,node):
+        try:
+            #after a failure the remaining actions are skipped
+            if self._error is None:
+                start = time.perf_counter()
+                output = self._instHandler.runAction(node.action)
+                end = time.perf_counter()
+                if self._output is not None:
+                    self._output.addStepData(node.action,output)
+                if self._progress is not None:
+                    self._progress.done(node.action,output,end-start,time.perf_counter()-end)
+        except BaseException as error:
+            with self._lock:
+                if self._error is None:
+                    self._error = error
+        finally:
+            with self._lock:
+                node.done = True
+                ready = []
+                for dependent in node.dependents:
+                    dependent.remaining -= 1
+                    if dependent.remaining == 0:
+                        ready.append(dependent)
+                #drop the references so finished nodes can be freed
+                node.dependents = None
+            for dependent in ready:
+                self._submit(executor,dependent)
+            self._slots.release()
+
+    def run(self,actions):
+        self._error = None
+        self._slots = threading.Semaphore(self._window)
+        with ThreadPoolExecutor(max_workers=self._workers,thread_name_prefix='Scheduler') as executor:
+            for node in self.graph(actions):
+                if self._error is not None:
+                    break
+                self._slots.acquire()
+                with self._lock:
+                    for dependency in node.dependencies:
+                        if not dependency.done:
+                            dependency.dependents.append(node)
+                            node.remaining += 1
+                    node.dependencies = None
+                    ready = node.remaining == 0
+                if ready:
+                    self._submit(executor,node)
+            #wait until every dispatched action has finished, they may still submit the ones waiting for them
+            for slot in range(self._window):
+                self._slots.acquire()
+        if self._error is not None:
+            raise self._error